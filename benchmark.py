@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+# main.py reads its configuration at import time, so the fake token and the temporary database
+# have to be in place before it is imported
+WORKDIR = tempfile.mkdtemp(prefix='booking_bot_bench_')
+os.environ['BOT_TOKEN'] = '123456789:' + 'A' * 35
+os.environ['DATABASE'] = os.path.join(WORKDIR, 'reserve.db')
+# STORAGE=memory takes the database out of the measurement
+os.environ.setdefault('STORAGE', 'sqlite')
+
+from aiogram import Bot  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import main  # noqa: E402
+
+TIMES = ['09:00', '10:00', '11:00', '12:00', '13:00', '14:00', '15:00', '16:00', '17:00', '18:00']
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.calls = Counter()
+        self.message_id = 0
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        if method in ('sendMessage', 'editMessageText'):
+            self.message_id += 1
+            return {
+                'message_id': self.message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(data['chat_id']), 'type': 'private'},
+                'text': data.get('text'),
+            }
+        return True
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.commits = 0
+
+    def __call__(self, statement):
+        self.count += 1
+        if statement == 'COMMIT':
+            self.commits += 1
+
+
+class UpdateFactory:
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 0
+
+    def next_ids(self):
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    def message(self, chat_id, text=None, contact=None):
+        update_id, message_id = self.next_ids()
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        if contact is not None:
+            message['contact'] = contact
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, chat_id, data):
+        update_id, message_id = self.next_ids()
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'chat_instance': str(chat_id),
+                'data': data,
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'Bot'},
+                    'text': 'menu',
+                },
+            },
+        }
+
+
+def booking_flow(factory, chat_id, day):
+    category_id = chat_id % 5 + 1
+    return [
+        factory.message(chat_id, '/start'),
+        factory.message(chat_id, '🇺🇸 English'),
+        factory.message(chat_id, contact={'phone_number': f'+998{chat_id:09d}', 'first_name': 'User',
+                                          'user_id': chat_id}),
+        factory.message(chat_id, '/booking'),
+        factory.message(chat_id, 'Booking'),
+        factory.callback(chat_id, f'category_{category_id}'),
+        factory.callback(chat_id, f'calendar:day:{day.year}:{day.month}:{day.day}:{category_id}'),
+        factory.message(chat_id, TIMES[chat_id % len(TIMES)]),
+        factory.callback(chat_id, 'plus_1'),
+        factory.callback(chat_id, 'reserve_2'),
+        factory.message(chat_id, '/cancel'),
+    ]
+
+
+async def run_chat(updates, latencies):
+    for data in updates:
+        update = Update(**data)
+        started = time.perf_counter()
+        await main.dp.process_update(update)
+        latencies.append(time.perf_counter() - started)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def benchmark(chats, concurrency):
+    telegram = FakeTelegram()
+    main.bot.request = telegram.request
+    Bot.set_current(main.bot)
+    main.dp.set_current(main.dp)
+
+    counter = QueryCounter()
+    sqlite = main.config.STORAGE == 'sqlite'
+    if sqlite:
+        for connection in main.db.database.connections():
+            connection.set_trace_callback(counter)
+    await main.on_startup(main.dp)
+
+    factory = UpdateFactory()
+    day = date.today() + timedelta(days=30)
+    flows = [booking_flow(factory, chat_id, day) for chat_id in range(1, chats + 1)]
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(updates):
+        async with semaphore:
+            await run_chat(updates, latencies)
+
+    counter.count = counter.commits = 0
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(updates) for updates in flows))
+    elapsed = time.perf_counter() - started
+    await main.on_shutdown(main.dp)
+
+    total = len(latencies)
+    api_calls = sum(telegram.calls.values())
+    print(f'chats:                 {chats}')
+    print(f'updates:               {total}')
+    print(f'elapsed:               {elapsed:.2f} s')
+    print(f'throughput:            {total / elapsed:.1f} updates/s')
+    print(f'latency p50:           {statistics.median(latencies) * 1000:.2f} ms')
+    print(f'latency p99:           {percentile(latencies, 0.99) * 1000:.2f} ms')
+    print(f'storage:               {main.config.STORAGE}')
+    if sqlite:
+        print(f'db queries/update:     {counter.count / total:.2f}')
+        print(f'commits/s:             {counter.commits / elapsed:.1f} ({counter.commits / total:.2f}/update)')
+    print(f'telegram calls/update: {api_calls / total:.2f}')
+    for method, count in telegram.calls.most_common():
+        print(f'  {method}: {count}')
+
+    callbacks = [data['callback_query']['data'] for updates in flows for data in updates if 'callback_query' in data]
+    started = time.perf_counter()
+    for callback_data in callbacks:
+        main.router.resolve(callback_data)
+    print(f'callback routing:      {(time.perf_counter() - started) / len(callbacks) * 1e6:.2f} us/callback')
+
+    texts = [data['message']['text'] for updates in flows for data in updates if 'text' in data.get('message', {})]
+    started = time.perf_counter()
+    for text in texts:
+        main.intents.resolve(text)
+    print(f'text routing:          {(time.perf_counter() - started) / len(texts) * 1e6:.2f} us/message')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Push synthetic booking flows through the dispatcher')
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        asyncio.run(benchmark(args.chats, args.concurrency))
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
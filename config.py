@@ -0,0 +1,32 @@
+import os
+import secrets
+
+BOT_TOKEN = os.getenv('BOT_TOKEN', '')
+DATABASE = os.getenv('DATABASE', 'reserve.db')
+
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', 8080))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', os.cpu_count() or 1))
+# Telegram sends it back with every update and anything without it is rejected. Set it when the webhook
+# is registered elsewhere; otherwise a random one is passed to set_webhook on every start
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_FILE = os.getenv('METRICS_FILE', '')
+METRICS_DUMP_INTERVAL = int(os.getenv('METRICS_DUMP_INTERVAL', 60))
+
+# Profiling mode: statements slower than this are logged with their query plan, 0 turns it off
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 0))
+
+# Storage backend: 'sqlite' (DATABASE file), 'memory' (tests and benchmarks, nothing is persisted)
+# or 'postgres' (POSTGRES_DSN, lets several bot processes or hosts share state)
+STORAGE = os.getenv('STORAGE', 'sqlite')
+POSTGRES_DSN = os.getenv('POSTGRES_DSN', 'postgresql://localhost/booking_bot')
+
+# Bookings that started more than ARCHIVE_AFTER_DAYS ago are moved to the archive every
+# ARCHIVE_INTERVAL seconds, 0 turns archiving off
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+ARCHIVE_INTERVAL = int(os.getenv('ARCHIVE_INTERVAL', 60 * 60))
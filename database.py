@@ -1,18 +1,139 @@
+import asyncio
+import calendar
+import logging
+import queue
+import re
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache, partial
+
+import config
+import migrations
+from cache import LRUCache
+from metrics import registry
+from schedules import Schedules
+
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 600
+OCCUPANCY_CACHE_SIZE = 2048
+AVAILABILITY_CACHE_SIZE = 512
+# Slot occupancy and month rollups are only invalidated by this process's own writes. When several
+# webhook workers share the database file they expire after this many seconds instead, so bookings
+# made by another worker show up; reserve() always recounts under the write lock regardless
+SHARED_CACHE_TTL = 2
+# Compiled schedules are reloaded this often, or every SHARED_CACHE_TTL seconds in shared mode, so
+# edits made in SQL or by another process are picked up without a restart
+SCHEDULES_TTL = 60
+
+READ_POOL_SIZE = 4
+WRITE_BEHIND_SIZE = 200
+WRITE_BEHIND_INTERVAL = 1
+STATEMENT_CACHE_SIZE = 256
+ARCHIVE_BATCH_SIZE = 500
+VACUUM_PAGES = 1000
+BUSY_TIMEOUT = 5
+PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+
+def to_timestamp(moment):
+    # Bookings are stored in naive local time, so they are converted without a timezone shift,
+    # the same way SQLite's strftime('%s', ...) does it
+    return calendar.timegm(moment.timetuple())
+
+
+# Placeholder lists built for a batch of ids, so every batch size shares one label
+IN_LIST = re.compile(r'\bIN \(\?(?:, ?\?)*\)', re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
+def statement_label(sql):
+    return IN_LIST.sub('IN (…)', ' '.join(sql.split()))
+
+
+def to_start_at(date, time):
+    return to_timestamp(datetime.strptime(f'{date} {time}', '%Y-%m-%d %H:%M'))
+
+
+def month_range(year, month):
+    # Bounds of a month as the 'YYYY-MM-DD' strings booking.date holds, end exclusive
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f'{year:04d}-{month:02d}-01', f'{next_year:04d}-{next_month:02d}-01'
+
+
+def month_key(category_id, date):
+    year, month, _ = str(date).split('-')
+    return int(category_id), int(year), int(month)
+
+
+def connect(path, readonly=False):
+    if readonly:
+        connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False,
+                                     timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE)
+    else:
+        connection = sqlite3.connect(path, check_same_thread=False,
+                                     timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE)
+        connection.execute('PRAGMA journal_mode = WAL')
+    for pragma in PRAGMAS:
+        connection.execute(pragma)
+    return connection
 
 
 class Database:
-    def __init__(self):
-        self.database = sqlite3.connect('reserve.db', check_same_thread=False)
-        self.create_users_table()
-        self.create_categories_table()
+    def __init__(self, path=config.DATABASE, slow_query_ms=config.SLOW_QUERY_MS, read_pool_size=READ_POOL_SIZE,
+                 shared=config.BOT_MODE == 'webhook' and config.WEBHOOK_WORKERS > 1):
+        # One writer connection guarded by a lock, and a pool of read-only connections that
+        # run next to it thanks to WAL
+        self.database = connect(path)
+        self.write_lock = threading.RLock()
+        self.readers = queue.Queue()
+        for _ in range(read_pool_size):
+            self.readers.put(connect(path, readonly=True))
+        self.slow_query_ms = slow_query_ms
+        self.query_stats = {}
+        self.query_stats_lock = threading.Lock()
+        self.pending_writes = []
+        self.pending_lock = threading.Lock()
+        self.users = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+        self.categories_version = 0
+        cache_ttl = SHARED_CACHE_TTL if shared else None
+        self.occupancy = LRUCache(maxsize=OCCUPANCY_CACHE_SIZE, ttl=cache_ttl)
+        self.occupancy_lock = threading.Lock()
+        self.availability = LRUCache(maxsize=AVAILABILITY_CACHE_SIZE, ttl=cache_ttl)
+        self.schedules_ttl = SHARED_CACHE_TTL if shared else SCHEDULES_TTL
+        self.schedules = None
+        self.schedule_rows = None
+        self.schedules_loaded = 0
+
+    def migrate(self):
+        with self.connection(write=True) as db:
+            version = migrations.migrate(db)
+            # auto_vacuum can only be switched on by rebuilding the file, which is done once here;
+            # afterwards archiving gives pages back with PRAGMA incremental_vacuum
+            if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                db.execute('VACUUM')
+        self.categories_version += 1
+        self.users.clear()
+        self.occupancy.clear()
+        self.schedules = None
+        self.availability.clear()
+        return version
 
     def manager(self, sql, *args,
                 fetchone: bool = False,
                 fetchall: bool = False,
                 commit: bool = False):
-        with self.database as db:
+        started = time.perf_counter()
+        with self.connection(write=commit) as db:
             cursor = db.cursor()
             cursor.execute(sql, args)
             if commit:
@@ -21,200 +142,338 @@ class Database:
                 result = cursor.fetchone()
             if fetchall:
                 result = cursor.fetchall()
-            return result
+        self.record_query(sql, args, started, cursor, result, fetchone, fetchall)
+        return result
 
-    def create_users_table(self):
-        sql = '''
-        CREATE TABLE IF NOT EXISTS users(
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER UNIQUE,
-            full_name TEXT,
-            phone TEXT,
-            language TEXT
-            )
-            '''
-        self.manager(sql, commit=True)
+    def execute(self, cursor, sql, *args, fetchone=False, fetchall=False):
+        # For statements that have to share a transaction: same metrics and slow-query log as manager
+        started = time.perf_counter()
+        cursor.execute(sql, args)
+        result = None
+        if fetchone:
+            result = cursor.fetchone()
+        if fetchall:
+            result = cursor.fetchall()
+        self.record_query(sql, args, started, cursor, result, fetchone, fetchall)
+        return result
+
+    def record_query(self, sql, args, started, cursor, result, fetchone, fetchall):
+        if fetchall:
+            rows = len(result)
+        elif fetchone:
+            rows = int(result is not None)
+        else:
+            rows = max(cursor.rowcount, 0)
+        elapsed = time.perf_counter() - started
+        label = statement_label(sql)
+        registry.observe('db_query_seconds', elapsed, statement=label)
+        registry.inc('db_query_rows_total', rows, statement=label)
+        if self.slow_query_ms:
+            self.profile_query(sql, label, args, elapsed, rows)
+
+    def profile_query(self, sql, label, args, elapsed, rows):
+        with self.query_stats_lock:
+            stats = self.query_stats.setdefault(label, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3] += rows
+        if elapsed * 1000 >= self.slow_query_ms:
+            plan = '; '.join(self.explain_query_plan(sql, *args))
+            logging.warning('Slow query (%.1f ms, %s rows): %s %s plan: %s',
+                            elapsed * 1000, rows, label, args, plan or '-')
+
+    def query_report(self, limit=10):
+        with self.query_stats_lock:
+            top = sorted(self.query_stats.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        lines = [f"{'calls':>8} {'total ms':>10} {'avg ms':>8} {'max ms':>8} {'rows':>8}  statement"]
+        for label, (calls, total, longest, rows) in top:
+            lines.append(f'{calls:>8} {total * 1000:>10.1f} {total * 1000 / calls:>8.2f} '
+                         f'{longest * 1000:>8.2f} {rows:>8}  {label}')
+        return '\n'.join(lines)
+
+    @contextmanager
+    def connection(self, write=False):
+        if write:
+            with self.write_lock, self.database as db:
+                yield db
+            return
+        reader = self.readers.get()
+        try:
+            yield reader
+        finally:
+            self.readers.put(reader)
+
+    def connections(self):
+        return [self.database] + list(self.readers.queue)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection(write=True) as db:
+            db.execute('BEGIN IMMEDIATE')
+            yield db.cursor()
+
+    def close(self):
+        self.flush_writes()
+        for connection in self.connections():
+            connection.close()
+
+    def defer(self, sql, *args):
+        # Queues a non-critical write; queued writes are committed together in one transaction
+        # by flush_writes, which runs on a timer, when the queue is full and at shutdown
+        with self.pending_lock:
+            self.pending_writes.append((sql, args))
+            full = len(self.pending_writes) >= WRITE_BEHIND_SIZE
+        if full:
+            self.flush_writes()
+
+    def flush_writes(self):
+        with self.write_lock:
+            with self.pending_lock:
+                writes, self.pending_writes = self.pending_writes, []
+            if not writes:
+                return 0
+            try:
+                with registry.timer('db_query_seconds', statement='write-behind flush'), self.transaction() as cursor:
+                    for sql, args in writes:
+                        self.execute(cursor, sql, *args)
+            except sqlite3.OperationalError:
+                # Usually another process holding the file past BUSY_TIMEOUT; the writes go back in front
+                # of anything queued meanwhile and the next flush retries them in the same order
+                with self.pending_lock:
+                    self.pending_writes[:0] = writes
+                raise
+        registry.inc('db_deferred_writes_total', len(writes))
+        return len(writes)
+
+    def explain_query_plan(self, sql, *args):
+        with self.connection() as db:
+            try:
+                plan = db.execute(f'EXPLAIN QUERY PLAN {sql}', args).fetchall()
+            except sqlite3.Error:
+                return []
+        return [row[3] for row in plan]
 
     def get_user_by_chat_id(self, chat_id):
+        user = self.users.get(chat_id)
+        if user:
+            return user
+        if self.pending_writes:
+            self.flush_writes()
+        version = self.users.version
         sql = '''
         SELECT * FROM users WHERE chat_id = ?
         '''
-        return self.manager(sql, chat_id, fetchone=True)
+        user = self.manager(sql, chat_id, fetchone=True)
+        if user:
+            self.users.fill(chat_id, user, version)
+        return user
+
+    def user_cache_stats(self):
+        return self.users.stats()
 
     def first_register_user(self, chat_id, full_name):
         sql = '''
         INSERT INTO users(chat_id, full_name) VALUES (?,?)
         '''
         self.manager(sql, chat_id, full_name, commit=True)
+        self.users.pop(chat_id)
 
     def update_user_to_finish_register(self, chat_id, phone):
+        user = self.get_user_by_chat_id(chat_id)
         sql = '''
         UPDATE users SET phone = ?
         WHERE chat_id = ?
         '''
-        self.manager(sql, phone, chat_id, commit=True)
+        self.defer(sql, phone, chat_id)
+        if user:
+            self.users.set(chat_id, user[:3] + (phone,) + user[4:])
+        else:
+            self.users.pop(chat_id)
 
     def set_user_language(self, chat_id, lang):
         user = self.get_user_by_chat_id(chat_id)
+        sql = '''
+        INSERT INTO users (chat_id, language) VALUES (?,?)
+        ON CONFLICT(chat_id) DO UPDATE SET language = excluded.language
+        '''
+        self.defer(sql, chat_id, lang)
         if user:
-            sql = '''
-            UPDATE users SET language = ? WHERE chat_id = ?
-            '''
-            self.manager(sql, lang, chat_id, commit=True)
+            self.users.set(chat_id, user[:4] + (lang,))
         else:
-            sql = '''
-            INSERT INTO users (chat_id, language) VALUES (?,?)
-            '''
-            self.manager(sql, chat_id, lang, commit=True)
+            self.users.pop(chat_id)
 
     def get_user_language(self, chat_id):
-        sql = '''
-        SELECT language FROM users WHERE chat_id = ?
-        '''
-        result = self.manager(sql, chat_id, fetchone=True)
-        if result:
-            return result[0]
+        user = self.get_user_by_chat_id(chat_id)
+        if user:
+            return user[4]
         return None
 
-    def create_categories_table(self):
-        sql = '''
-        CREATE TABLE IF NOT EXISTS categories(
-        category_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        category_name VARCHAR(100),
-        category_name_ru VARCHAR(100) NOT NULL,
-        category_name_uz VARCHAR(100) NOT NULL
-        )
-        '''
-        self.manager(sql, commit=True)
-
-    def categories_table_empty(self):
-        sql = '''
-        SELECT COUNT(*) FROM categories
-        '''
-        result = self.manager(sql, fetchone=True)
-        return result[0] == 0
-
-    def insert_categories(self):
-        if self.categories_table_empty():
-            sql = '''
-            INSERT INTO categories (category_name, category_name_ru, category_name_uz) VALUES
-            ('Air tickets', 'Авиабилеты', 'Aviabiletlar'),
-            ('Hotels', 'Отели и гостиницы', 'Mehmonxonalar'),
-            ('Restaurants', 'Столик в рестаране', 'Restoranlar'),
-            ('Museums', 'Музеи', 'Muzeylar'),
-            ('Special-events', 'Special-events', 'Special-events')
-            '''
-            self.manager(sql, commit=True)
-
     def get_all_categories(self):
         sql = '''
         SELECT * FROM categories
         '''
         return self.manager(sql, fetchall=True)
 
-    def create_booking_table(self):
-        sql = '''
-        CREATE TABLE IF NOT EXISTS booking(
-        booking_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        category_id INTEGER REFERENCES categories(category_id),
-        date DATE,
-        time TEXT,
-        amount_people INTEGER,
-        chat_id INTEGER REFERENCES users(chat_id),
-        reminder_sent BOOLEAN DEFAULT 0
-        )
-        '''
-        self.manager(sql, commit=True)
+    def load_schedules(self):
+        categories = self.manager('''
+        SELECT category_id, capacity, opens_at, closes_at, slot_minutes
+        FROM categories
+        ''', fetchall=True)
+        overrides = self.manager('''
+        SELECT category_id, date, closed, capacity, opens_at, closes_at, slot_minutes
+        FROM schedule_overrides
+        ''', fetchall=True)
+        # Month rollups were computed from the old schedules, so a change found on reload drops them
+        if self.schedules is None or (categories, overrides) != self.schedule_rows:
+            self.schedule_rows = (categories, overrides)
+            self.schedules = Schedules(categories, overrides)
+            self.availability.clear()
+        self.schedules_loaded = time.monotonic()
+        return self.schedules
+
+    def get_schedules(self):
+        # Compiled on first use, so every process builds it whether or not it ran the migrations
+        if self.schedules is None or time.monotonic() - self.schedules_loaded > self.schedules_ttl:
+            return self.load_schedules()
+        return self.schedules
 
-    def get_date(self, category_id, date, chat_id):
+    def get_schedule(self, category_id, date):
+        return self.get_schedules().get(int(category_id), date)
+
+    def schedules_changed(self):
+        self.schedules = None
+        self.availability.clear()
+
+    def set_category_schedule(self, category_id, capacity, opens_at, closes_at, slot_minutes):
         sql = '''
-        INSERT INTO booking(category_id, date, chat_id) VALUES (?,?,?)
+        UPDATE categories
+        SET capacity = ?, opens_at = ?, closes_at = ?, slot_minutes = ?
+        WHERE category_id = ?
         '''
-        self.manager(sql, category_id, date, chat_id, commit=True)
+        self.manager(sql, capacity, opens_at, closes_at, slot_minutes, category_id, commit=True)
+        self.schedules_changed()
 
-    def update_time(self, time, chat_id):
+    def set_schedule_override(self, category_id, date, closed=False, capacity=None, opens_at=None, closes_at=None,
+                              slot_minutes=None):
         sql = '''
-        UPDATE booking
-        SET time = ?
-        WHERE chat_id = ? AND time IS NULL
+        INSERT OR REPLACE INTO schedule_overrides
+        (category_id, date, closed, capacity, opens_at, closes_at, slot_minutes)
+        VALUES (?,?,?,?,?,?,?)
         '''
-        self.manager(sql, time, chat_id, commit=True)
+        self.manager(sql, category_id, date, closed, capacity, opens_at, closes_at, slot_minutes, commit=True)
+        self.schedules_changed()
 
-    def update_amount_people(self, chat_id, amount_people):
+    def delete_schedule_override(self, category_id, date):
         sql = '''
-        UPDATE booking
-        SET amount_people = ?
-        WHERE chat_id = ? AND amount_people IS NULL
+        DELETE FROM schedule_overrides
+        WHERE category_id = ? AND date = ?
         '''
-        self.manager(sql, amount_people, chat_id, commit=True)
+        self.manager(sql, category_id, date, commit=True)
+        self.schedules_changed()
+
+    def reserve(self, chat_id, category_id, date, time, amount_people):
+        schedule = self.get_schedule(category_id, date)
+        if not schedule.is_open(time):
+            return None, 0
+        max_capacity = schedule.capacity
+        with registry.timer('db_query_seconds', statement='reserve'), self.transaction() as cursor:
+            booked = self.execute(cursor, '''
+            SELECT COUNT(*)
+            FROM booking
+            WHERE category_id = ? AND date = ? AND time = ? AND amount_people IS NOT NULL
+            ''', category_id, date, time, fetchone=True)[0]
+            booking_id = None
+            if booked < max_capacity:
+                self.execute(cursor, '''
+                INSERT INTO booking(category_id, date, time, amount_people, chat_id, start_at)
+                VALUES (?,?,?,?,?,?)
+                ''', category_id, date, time, amount_people, chat_id, to_start_at(date, time))
+                booking_id = cursor.lastrowid
+                booked += 1
+            self.set_occupancy(category_id, date, time, booked)
+        if booking_id:
+            # Dropped after the commit, so a concurrent read cannot cache the month without this booking
+            self.availability.pop(month_key(category_id, date))
+        return booking_id, max_capacity - booked
 
-    def generate_time_slots(self, start_time="09:00", end_time="21:00", interval_minutes=60):
-        start = datetime.strptime(start_time, "%H:%M")
-        end = datetime.strptime(end_time, "%H:%M")
-        slots = []
-        while start <= end:
-            slots.append(start.strftime("%H:%M"))
-            start += timedelta(minutes=interval_minutes)
-        return slots
+    def get_slot_occupancy(self, category_id, date):
+        key = (int(category_id), str(date))
+        occupancy = self.occupancy.get(key)
+        if occupancy is None:
+            version = self.occupancy.version
+            sql = '''
+            SELECT time, COUNT(*)
+            FROM booking
+            WHERE category_id = ? AND date = ? AND amount_people IS NOT NULL
+            GROUP BY time
+            '''
+            occupancy = dict(self.manager(sql, *key, fetchall=True))
+            self.occupancy.fill(key, occupancy, version)
+        return occupancy
+
+    def set_occupancy(self, category_id, date, time, count):
+        key = (int(category_id), str(date))
+        with self.occupancy_lock:
+            occupancy = self.occupancy.get(key)
+            if occupancy is None:
+                self.occupancy.pop(key)
+                return
+            occupancy = dict(occupancy)
+            occupancy[time] = count
+            self.occupancy.set(key, occupancy)
 
     def get_available_times(self, date, category_id):
-        sql = '''
-        SELECT time FROM booking
-        WHERE date = ? AND category_id = ?
-        '''
-        booked_times = self.manager(sql, date, category_id, fetchall=True)
-        booked_times = [time[0] for time in booked_times]
-
-        all_possible_times = self.generate_time_slots()
-
-        available_times = [time for time in all_possible_times if time not in booked_times]
-        return available_times
-
-    def get_max_capacity(self, category_id):
-        if category_id == 1:
-            return 5
-        elif category_id == 2:
-            return 10
-        elif category_id == 3:
-            return 20
-        elif category_id == 4:
-            return 10
-        else:
-            return 5
+        schedule = self.get_schedule(category_id, date)
+        occupancy = self.get_slot_occupancy(category_id, date)
+        return [time for time in schedule.slots if occupancy.get(time, 0) < schedule.capacity]
 
     def check_availability(self, category_id, date, time):
-        max_capacity = self.get_max_capacity(category_id)
-        sql = '''
-        SELECT COUNT(*)
-        FROM booking
-        WHERE category_id = ? AND date = ? AND time = ?
-        '''
-        result = self.manager(sql, category_id, date, time, fetchone=True)
-        return result[0] < max_capacity
+        schedule = self.get_schedule(category_id, date)
+        if not schedule.is_open(time):
+            return False
+        occupancy = self.get_slot_occupancy(category_id, date)
+        return occupancy.get(time, 0) < schedule.capacity
 
-    def get_last_booking(self, chat_id):
-        sql = '''
-        SELECT category_id, date, time
-        FROM booking
-        WHERE chat_id = ?
-        ORDER BY booking_id DESC
-        LIMIT 1
-        '''
-        result = self.manager(sql, chat_id, fetchone=True)
-        if result:
-            return {
-                'category_id': result[0],
-                'date': result[1],
-                'time': result[2]
-            }
-        return None
+    def get_month_availability(self, category_id, year, month):
+        key = (int(category_id), int(year), int(month))
+        availability = self.availability.get(key)
+        if availability is None:
+            version = self.availability.version
+            sql = '''
+            SELECT date, time, COUNT(*)
+            FROM booking
+            WHERE category_id = ? AND date >= ? AND date < ? AND amount_people IS NOT NULL
+            GROUP BY date, time
+            '''
+            rows = self.manager(sql, key[0], *month_range(key[1], key[2]), fetchall=True)
+            schedules = self.get_schedules()
+            availability = schedules.remaining_capacity(key[0], key[1], key[2], rows)
+            self.availability.fill(key, availability, version)
+        return availability
 
-    def get_all_booking(self, chat_id):
+    def get_upcoming_bookings(self, chat_id, now, limit, after=None, before=None):
+        # Keyset pagination on (start_at, booking_id), where start_at orders bookings by date and time
+        if before:
+            sql = '''
+            SELECT booking_id, date, time, start_at
+            FROM booking
+            WHERE chat_id = ? AND start_at >= ? AND amount_people IS NOT NULL
+            AND (start_at, booking_id) < (?, ?)
+            ORDER BY start_at DESC, booking_id DESC
+            LIMIT ?
+            '''
+            bookings = self.manager(sql, chat_id, to_timestamp(now), *before, limit, fetchall=True)
+            return bookings[::-1]
         sql = '''
-        SELECT * FROM booking
-        WHERE chat_id = ?
+        SELECT booking_id, date, time, start_at
+        FROM booking
+        WHERE chat_id = ? AND start_at >= ? AND amount_people IS NOT NULL
+        AND (start_at, booking_id) > (?, ?)
+        ORDER BY start_at, booking_id
+        LIMIT ?
         '''
-        return self.manager(sql, chat_id, fetchall=True)
+        return self.manager(sql, chat_id, to_timestamp(now), *(after or (0, 0)), limit, fetchall=True)
 
     def get_booking_by_id(self, booking_id):
         sql = '''
@@ -235,28 +494,145 @@ class Database:
         return None
 
     def delete_booking(self, booking_id):
+        sql = '''
+        SELECT category_id, date, time, amount_people
+        FROM booking
+        WHERE booking_id = ?
+        '''
+        booking = self.manager(sql, booking_id, fetchone=True)
         sql = '''
         DELETE FROM booking
         WHERE booking_id = ?
         '''
         self.manager(sql, booking_id, commit=True)
+        if booking and booking[3] is not None:
+            self.occupancy.pop((int(booking[0]), str(booking[1])))
+            self.availability.pop(month_key(booking[0], booking[1]))
+
+    def archive_batch(self, before, limit=ARCHIVE_BATCH_SIZE):
+        # Moves up to `limit` bookings that started before `before` to booking_archive. The candidates
+        # are a range search on idx_booking_start, and one short transaction per batch keeps the
+        # write lock free for the bot in between
+        with registry.timer('db_query_seconds', statement='archive batch'), self.transaction() as cursor:
+            bookings = self.execute(cursor, '''
+            SELECT booking_id, category_id, date, amount_people
+            FROM booking
+            WHERE start_at < ?
+            LIMIT ?
+            ''', to_timestamp(before), limit, fetchall=True)
+            if not bookings:
+                return 0
+            booking_ids = [booking[0] for booking in bookings]
+            placeholders = ', '.join('?' * len(booking_ids))
+            self.execute(cursor, f'''
+            INSERT OR REPLACE INTO booking_archive
+            (booking_id, category_id, date, time, amount_people, chat_id, reminder_sent, start_at, archived_at)
+            SELECT booking_id, category_id, date, time, amount_people, chat_id, reminder_sent, start_at, ?
+            FROM booking
+            WHERE booking_id IN ({placeholders})
+            ''', to_timestamp(datetime.now()), *booking_ids)
+            self.execute(cursor, f'''
+            DELETE FROM booking
+            WHERE booking_id IN ({placeholders})
+            ''', *booking_ids)
+        for _, category_id, date, amount_people in bookings:
+            if amount_people is not None:
+                self.occupancy.pop((int(category_id), str(date)))
+                self.availability.pop(month_key(category_id, date))
+        registry.inc('db_archived_bookings_total', len(bookings))
+        return len(bookings)
+
+    def incremental_vacuum(self, pages=VACUUM_PAGES):
+        # Returns how many free pages are left in the file
+        with self.connection(write=True) as db:
+            db.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+            return db.execute('PRAGMA freelist_count').fetchone()[0]
 
-    def get_bookings_for_reminder(self, reminder_time):
+    def get_pending_reminders(self, now):
         sql = '''
-        SELECT b.booking_id, b.chat_id, b.category_id, b.date, b.time, c.category_name
+        SELECT booking_id, start_at
+        FROM booking
+        WHERE reminder_sent = 0 AND start_at > ? AND amount_people IS NOT NULL
+        '''
+        return self.manager(sql, to_timestamp(now), fetchall=True)
+
+    def get_bookings_for_reminder(self, booking_ids):
+        # The join reads users.language, which may still be waiting in the write-behind queue
+        if self.pending_writes:
+            self.flush_writes()
+        placeholders = ', '.join('?' * len(booking_ids))
+        sql = f'''
+        SELECT b.booking_id, b.chat_id, b.category_id, b.date, b.time, c.category_name, u.language
         FROM booking b
         JOIN categories c ON b.category_id = c.category_id
-        WHERE b.reminder_sent = 0 
-        AND datetime(b.date || ' ' || b.time) BETWEEN ? AND ?
+        LEFT JOIN users u ON b.chat_id = u.chat_id
+        WHERE b.reminder_sent = 0
+        AND b.booking_id IN ({placeholders})
         '''
-        reminder_start = reminder_time.strftime("%Y-%m-%d %H:%M:%S")
-        reminder_end = (reminder_time + timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
-        return self.manager(sql, reminder_start, reminder_end, fetchall=True)
+        return self.manager(sql, *booking_ids, fetchall=True)
 
-    def mark_reminder_sent(self, booking_id):
-        sql = '''
+    def mark_reminders_sent(self, booking_ids):
+        placeholders = ', '.join('?' * len(booking_ids))
+        sql = f'''
         UPDATE booking
         SET reminder_sent = 1
-        WHERE booking_id = ?
+        WHERE booking_id IN ({placeholders})
         '''
-        self.manager(sql, booking_id, commit=True)
+        self.defer(sql, *booking_ids)
+
+    def release_reminders(self, booking_ids):
+        # Only one process runs reminders for a SQLite file, so get_bookings_for_reminder claims nothing
+        pass
+
+
+class AsyncDatabase:
+    # Runs Database calls on worker threads so queries never block the event loop; there is one
+    # thread per read connection plus one for the writer
+
+    def __init__(self, database=None, read_pool_size=READ_POOL_SIZE):
+        self.database = database or Database(read_pool_size=read_pool_size)
+        self.executor = ThreadPoolExecutor(max_workers=read_pool_size + 1, thread_name_prefix='database')
+
+    def __getattr__(self, name):
+        attr = getattr(self.database, name)
+        if not callable(attr):
+            return attr
+
+        async def method(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(attr, *args, **kwargs))
+
+        method.__name__ = name
+        setattr(self, name, method)
+        return method
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.database.close)
+        self.executor.shutdown()
+
+    async def archive_bookings(self, before, batch_size=ARCHIVE_BATCH_SIZE):
+        # Every batch and every vacuum step is a separate job on the executor, so queries
+        # queued in the meantime run between them
+        archived = 0
+        while True:
+            moved = await self.archive_batch(before, batch_size)
+            archived += moved
+            if moved < batch_size:
+                break
+        free = await self.incremental_vacuum()
+        while free:
+            left = await self.incremental_vacuum()
+            if left >= free:
+                break
+            free = left
+        return archived
+
+    async def flush_periodically(self, interval=WRITE_BEHIND_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush_writes()
+            except sqlite3.Error:
+                logging.exception('Failed to flush deferred writes')
+
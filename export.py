@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+
+import config
+from database import connect
+
+CHUNK_SIZE = 1000
+WRITER_POLL_INTERVAL = 0.05
+COLUMNS = ('booking_id', 'category_id', 'category_name', 'date', 'time', 'amount_people', 'chat_id',
+           'full_name', 'phone', 'language', 'reminder_sent', 'start_at')
+
+
+def build_query(table, placeholder, since_id=0, start=None, end=None, category_id=None, until_id=None):
+    # Rows come out in booking_id order, which is the primary key order, so no sort has to be
+    # buffered and the last id written is where the next incremental export starts
+    conditions = []
+    args = []
+
+    def condition(template, value):
+        args.append(value)
+        conditions.append(template.format(placeholder(len(args))))
+
+    condition('b.booking_id > {}', since_id)
+    if until_id is not None:
+        condition('b.booking_id <= {}', until_id)
+    if start:
+        condition('b.date >= {}', start)
+    if end:
+        condition('b.date <= {}', end)
+    if category_id:
+        condition('b.category_id = {}', category_id)
+    sql = f'''
+    SELECT b.booking_id, b.category_id, c.category_name, b.date, b.time, b.amount_people,
+           b.chat_id, u.full_name, u.phone, u.language, b.reminder_sent, b.start_at
+    FROM {table} b
+    LEFT JOIN categories c ON b.category_id = c.category_id
+    LEFT JOIN users u ON b.chat_id = u.chat_id
+    WHERE {' AND '.join(conditions)}
+    ORDER BY b.booking_id
+    '''
+    return sql, args
+
+
+def row_writer(output, fmt):
+    if fmt == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(COLUMNS)
+        return writer.writerow
+
+    def write(row):
+        output.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n')
+    return write
+
+
+def normalize(row):
+    row = list(row)
+    row[10] = bool(row[10])
+    return row
+
+
+def export_sqlite(path, sql, args, write):
+    # A read-only connection reads a WAL snapshot, so the bot keeps writing while the export runs
+    connection = connect(path, readonly=True)
+    count, last_id = 0, None
+    try:
+        cursor = connection.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                write(normalize(row))
+            count += len(rows)
+            last_id = rows[-1][0]
+    finally:
+        connection.close()
+    return count, last_id
+
+
+async def committed_bound(connection, table):
+    # BIGSERIAL ids are taken when a row is inserted, not when it commits, so a reserve still in
+    # flight can hold an id below rows that are already visible and an incremental export would skip
+    # it for good. Every id up to the largest visible one was taken by a transaction that held a
+    # RowExclusiveLock on the table at that moment; once those transactions end, none of those ids can
+    # still show up. Waiting for them takes no lock, so the bot keeps writing meanwhile
+    bound, writers = await connection.fetchrow(f'''
+    SELECT (SELECT COALESCE(MAX(booking_id), 0) FROM {table}),
+           ARRAY(SELECT virtualtransaction FROM pg_locks
+                 WHERE relation = '{table}'::regclass AND mode = 'RowExclusiveLock' AND pid <> pg_backend_pid())
+    ''')
+    while writers:
+        await asyncio.sleep(WRITER_POLL_INTERVAL)
+        writers = await connection.fetchval('''
+        SELECT ARRAY(SELECT virtualxid FROM pg_locks WHERE locktype = 'virtualxid' AND virtualxid = ANY($1::text[]))
+        ''', writers)
+    return bound
+
+
+async def export_postgres(dsn, table, write, since_id=0, incremental=False, **filters):
+    # A server-side cursor inside a read-only snapshot transaction; MVCC keeps writers unblocked
+    import asyncpg
+
+    connection = await asyncpg.connect(dsn)
+    count, last_id = 0, None
+    try:
+        until_id = await committed_bound(connection, table) if incremental else None
+        sql, args = build_query(table, lambda index: f'${index}', since_id, until_id=until_id, **filters)
+        async with connection.transaction(isolation='repeatable_read', readonly=True):
+            async for row in connection.cursor(sql, *args, prefetch=CHUNK_SIZE):
+                write(normalize(row))
+                count += 1
+                last_id = row[0]
+    finally:
+        await connection.close()
+    return count, last_id
+
+
+def read_state(path):
+    if path and os.path.exists(path):
+        with open(path) as file:
+            return int(file.read().strip() or 0)
+    return 0
+
+
+def write_state(path, last_id):
+    # Written to a temporary file first so an interrupted run never leaves a truncated state
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        file.write(f'{last_id}\n')
+    os.replace(temporary, path)
+
+
+def export(args, output):
+    since_id = args.since_id if args.since_id is not None else read_state(args.state)
+    table = 'booking_archive' if args.archived else 'booking'
+    write = row_writer(output, args.format)
+    if args.storage == 'sqlite':
+        sql, query_args = build_query(table, lambda index: '?', since_id, args.start, args.end, args.category)
+        count, last_id = export_sqlite(args.database, sql, query_args, write)
+    elif args.storage == 'postgres':
+        incremental = args.state is not None or args.since_id is not None
+        count, last_id = asyncio.run(export_postgres(args.dsn, table, write, since_id, incremental, start=args.start,
+                                                     end=args.end, category_id=args.category))
+    else:
+        raise SystemExit(f'Nothing to export from the {args.storage!r} storage backend')
+    output.flush()
+    if args.state and last_id is not None:
+        write_state(args.state, last_id)
+    return count, last_id
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Stream bookings with their category and user to CSV or JSON Lines')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    parser.add_argument('--output', help='file to write to, standard output by default')
+    parser.add_argument('--start', help='first booking date to export, YYYY-MM-DD')
+    parser.add_argument('--end', help='last booking date to export, YYYY-MM-DD')
+    parser.add_argument('--category', type=int, help='only export this category_id')
+    parser.add_argument('--since-id', type=int, help='only export bookings with a greater booking_id')
+    parser.add_argument('--state', help='file holding the last exported booking_id; it is read unless --since-id '
+                                        'is given and updated after every export')
+    parser.add_argument('--archived', action='store_true', help='export the archived bookings instead')
+    parser.add_argument('--storage', choices=('sqlite', 'postgres'), default=config.STORAGE)
+    parser.add_argument('--database', default=config.DATABASE)
+    parser.add_argument('--dsn', default=config.POSTGRES_DSN)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.output:
+        with open(args.output, 'w', newline='', encoding='utf-8') as output:
+            count, last_id = export(args, output)
+    else:
+        count, last_id = export(args, sys.stdout)
+    print(f'exported {count} bookings, last booking_id {last_id}', file=sys.stderr)
@@ -0,0 +1,29 @@
+class IntentRouter:
+    # Maps the exact text of every reply-keyboard button, in every language of langs, to the handler
+    # of that button, so a text message is routed with a single dict lookup
+    def __init__(self, langs):
+        self.langs = langs
+        self.texts = {}
+
+    def register(self, intent, handler):
+        for lang, texts in self.langs.items():
+            self.texts[texts[intent]] = (handler, lang)
+
+    def intent(self, *intents):
+        def decorator(handler):
+            for intent in intents:
+                self.register(intent, handler)
+            return handler
+        return decorator
+
+    def resolve(self, text):
+        # Returns the handler of the button and the language its text belongs to
+        return self.texts.get(text, (None, None))
+
+    def matches(self, message):
+        return message.text in self.texts
+
+    async def dispatch(self, message):
+        handler, _ = self.resolve(message.text)
+        if handler is not None:
+            await handler(message)
@@ -1,19 +1,21 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.callback_data import CallbackData
 import calendar
+from datetime import datetime
 
 from langs import langs
-from database import *
+from storage import db
+from cache import LRUCache
 
-db = Database()
+MARKUP_CACHE_SIZE = 512
+BOOKINGS_PAGE_SIZE = 5
+
+markup_cache = LRUCache(maxsize=MARKUP_CACHE_SIZE)
 
 
 def choose_lang_button():
     markup = ReplyKeyboardMarkup(resize_keyboard=True)
-    english = KeyboardButton(text='🇺🇸 English')
-    russian = KeyboardButton(text='🇷🇺 Русский')
-    uzbek = KeyboardButton(text='🇺🇿 Ozbek')
-    markup.row(english, russian, uzbek)
+    markup.row(*(KeyboardButton(text=texts['language_name']) for texts in langs.values()))
     return markup
 
 
@@ -31,9 +33,14 @@ def generate_reserve_button(lang):
     return markup
 
 
-def generate_category_menu(lang):
+async def generate_category_menu(lang):
+    key = ('category_menu', lang, db.categories_version)
+    markup = markup_cache.get(key)
+    if markup is not None:
+        return markup
+
     markup = InlineKeyboardMarkup(row_width=1)
-    categories = db.get_all_categories()
+    categories = await db.get_all_categories()
     buttons = []
     for category in categories:
         if lang == 'en':
@@ -46,16 +53,37 @@ def generate_category_menu(lang):
             btn = InlineKeyboardButton(text=category[3], callback_data=f'category_{category[0]}')
             buttons.append(btn)
     markup.add(*buttons)
+    markup_cache.set(key, markup)
     return markup
 
 
 calendar_callback = CallbackData('calendar', 'action', 'year', 'month', 'day', 'category')
 
 
-def generate_period_buttons(lang, year=None, month=None, category=None):
-    now = datetime.now()
-    year = year or now.year
-    month = month or now.month
+def strike(text):
+    return ''.join(char + '\u0336' for char in text)
+
+
+async def generate_period_buttons(lang, year=None, month=None, category=None):
+    today = datetime.now().date()
+    year = year or today.year
+    month = month or today.month
+
+    # Past days are struck through and fully booked ones crossed out; neither can be picked. The
+    # markup only depends on which days are closed, not on the exact capacity left
+    availability = await db.get_month_availability(category, year, month)
+    full = frozenset(day for day, remaining in availability.items() if remaining <= 0)
+    if (year, month) < (today.year, today.month):
+        first_open = len(availability) + 1
+    elif (year, month) == (today.year, today.month):
+        first_open = today.day
+    else:
+        first_open = 1
+
+    key = ('period', lang, year, month, category, first_open, full)
+    markup = markup_cache.get(key)
+    if markup is not None:
+        return markup
 
     markup = InlineKeyboardMarkup(row_width=7)
 
@@ -71,6 +99,10 @@ def generate_period_buttons(lang, year=None, month=None, category=None):
         for day in week:
             if day == 0:
                 row.append(InlineKeyboardButton(' ', callback_data='ignore'))
+            elif day < first_open:
+                row.append(InlineKeyboardButton(strike(str(day)), callback_data='ignore'))
+            elif day in full:
+                row.append(InlineKeyboardButton('✖', callback_data='ignore'))
             else:
                 row.append(InlineKeyboardButton(
                     str(day),
@@ -93,6 +125,7 @@ def generate_period_buttons(lang, year=None, month=None, category=None):
     markup.row(
         InlineKeyboardButton(text=langs[lang]['back'], callback_data='main_menu')
     )
+    markup_cache.set(key, markup)
     return markup
 
 
@@ -117,9 +150,9 @@ def generate_calculator_people(lang, c=1):
     return markup
 
 
-def generate_alternative_times(date, category_id, lang):
+async def generate_alternative_times(date, category_id, lang):
     markup = InlineKeyboardMarkup(row_width=3)
-    available_times = db.get_available_times(date, category_id)
+    available_times = await db.get_available_times(date, category_id)
 
     for time in available_times:
         btn = InlineKeyboardButton(text=time, callback_data=f'alternative_{time}')
@@ -131,14 +164,33 @@ def generate_alternative_times(date, category_id, lang):
     return markup
 
 
-def generate_all_reserving(chat_id):
+async def generate_all_reserving(chat_id, after=None, before=None):
     markup = InlineKeyboardMarkup(row_width=3)
-    bookings = db.get_all_booking(chat_id)
+    # One extra row is fetched to find out whether there is a page beyond this one
+    bookings = await db.get_upcoming_bookings(chat_id, datetime.now(), BOOKINGS_PAGE_SIZE + 1,
+                                              after=after, before=before)
+    more = len(bookings) > BOOKINGS_PAGE_SIZE
+    if before:
+        bookings = bookings[-BOOKINGS_PAGE_SIZE:]
+        has_prev, has_next = more, True
+    else:
+        bookings = bookings[:BOOKINGS_PAGE_SIZE]
+        has_prev, has_next = after is not None, more
 
     for book in bookings:
-        btn_text = f"{book[2]} {book[3]}"
+        btn_text = f"{book[1]} {book[2]}"
         btn = InlineKeyboardButton(text=btn_text, callback_data=f'view-booking_{book[0]}')
         markup.add(btn)
+
+    pages = []
+    if has_prev and bookings:
+        first = bookings[0]
+        pages.append(InlineKeyboardButton('Prev', callback_data=f'bookings:prev:{first[3]}:{first[0]}'))
+    if has_next and bookings:
+        last = bookings[-1]
+        pages.append(InlineKeyboardButton('Next', callback_data=f'bookings:next:{last[3]}:{last[0]}'))
+    if pages:
+        markup.row(*pages)
     return markup
 
 
@@ -38,6 +38,7 @@ langs = {
         'choose_option': 'Choose option',
         'change_lang': 'Change language',
         'select_lang': 'Select language',
+        'language_name': '🇺🇸 English',
         'reminder': 'Reminder! Your booking is scheduled for'
     },
 
@@ -80,6 +81,7 @@ langs = {
         'choose_option': 'Выберите опцию',
         'change_lang': 'Сменить язык',
         'select_lang': 'Выберите язык',
+        'language_name': '🇷🇺 Русский',
         'reminder': 'Напоминание! Ваша бронь запланирована на'
     },
 
@@ -123,6 +125,7 @@ langs = {
         'choose_option': 'Tanlang opciya',
         'change_lang': "Tilni ozgartiring",
         'select_lang': 'Tilni tanlang',
+        'language_name': '🇺🇿 Ozbek',
         'reminder': 'Eslatma! Sizning broningiz'
     }
 }
@@ -1,164 +1,187 @@
-from aiogram import Bot, Dispatcher, executor
+from aiogram import Dispatcher, executor
 from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery
-from aiogram.utils.callback_data import CallbackData
 from datetime import datetime, timedelta
 import asyncio
-
-from database import Database
-from keyboard import choose_lang_button, generate_contact_button, generate_reserve_button, generate_category_menu, \
-    generate_period_buttons, generate_calculator_people, generate_alternative_times, generate_all_reserving, \
-    generate_booking_cancel, generate_settings
+import logging
+import signal
+
+from keyboard import choose_lang_button, generate_contact_button, generate_reserve_button, \
+    generate_category_menu, generate_period_buttons, generate_calculator_people, generate_alternative_times, \
+    generate_all_reserving, generate_booking_cancel, generate_settings
+import config
+from cache import LRUCache
+from database import to_start_at, to_timestamp
 from langs import langs
+from reminders import ReminderScheduler, ReminderSender
+from intents import IntentRouter
+from router import CallbackRouter
+from storage import db
+import webhook
+from metrics import MeteredBot, start_metrics, timed
+
 
+DRAFTS_SIZE = 10000
+DRAFT_TTL = 60 * 60
 
-bot = Bot(token='')
+bot = MeteredBot(token=config.BOT_TOKEN)
 dp = Dispatcher(bot)
-db = Database()
+drafts = LRUCache(maxsize=DRAFTS_SIZE, ttl=DRAFT_TTL)
+router = CallbackRouter()
+intents = IntentRouter(langs)
+
+
+@dp.callback_query_handler()
+async def route_callback(call: CallbackQuery):
+    await router.dispatch(call)
+
+
+@dp.message_handler(intents.matches)
+async def route_intent(message: Message):
+    await intents.dispatch(message)
 
 
 @dp.message_handler(commands=['start'])
+@timed
 async def command_start(message: Message):
     chat_id = message.chat.id
-    db.create_users_table()
-    await bot.send_message(chat_id, 'Select language\nВыберите язык\nTilni tanlang', reply_markup=choose_lang_button())
+    text = '\n'.join(texts['select_lang'] for texts in langs.values())
+    await bot.send_message(chat_id, text, reply_markup=choose_lang_button())
 
 
-@dp.message_handler(regexp=r'(\🇺🇸 English|\🇷🇺 Русский|\🇺🇿 Ozbek)')
+@intents.intent('language_name')
+@timed
 async def get_lang_register_user(message: Message):
-    lang = message.text
+    _, lang = intents.resolve(message.text)
     chat_id = message.chat.id
     full_name = message.from_user.full_name
-    user = db.get_user_by_chat_id(chat_id)
-    if lang == '🇷🇺 Русский':
-        lang = 'ru'
-    elif lang == '🇺🇿 Ozbek':
-        lang = 'uz'
-    else:
-        lang = 'en'
+    user = await db.get_user_by_chat_id(chat_id)
     if user:
-        db.set_user_language(chat_id, lang)
+        await db.set_user_language(chat_id, lang)
     else:
-        db.first_register_user(chat_id, full_name)
-        db.set_user_language(chat_id, lang)
+        await db.first_register_user(chat_id, full_name)
+        await db.set_user_language(chat_id, lang)
         await message.answer(langs[lang]['select_language'])
     await message.answer(langs[lang]['registration'], reply_markup=generate_contact_button(lang))
 
 
 @dp.message_handler(content_types=['contact'])
+@timed
 async def finish_register(message: Message):
     chat_id = message.chat.id
     phone = message.contact.phone_number
-    lang = db.get_user_language(chat_id)
-    db.update_user_to_finish_register(chat_id, phone)
+    lang = await db.get_user_language(chat_id)
+    await db.update_user_to_finish_register(chat_id, phone)
     await message.answer(langs[lang]['reg_complete'], reply_markup=ReplyKeyboardRemove())
 
 
 @dp.message_handler(commands=['help'])
+@timed
 async def command_help(message: Message):
     chat_id = message.chat.id
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     await bot.send_message(chat_id, langs[lang]['help'])
 
 
 @dp.message_handler(commands=['booking'])
+@timed
 async def command_booking(message: Message):
     chat_id = message.chat.id
-    db.create_booking_table()
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     await bot.send_message(chat_id, langs[lang]['booking'], reply_markup=generate_reserve_button(lang))
 
 
-@dp.message_handler(regexp='Booking|Забронировать|Buyurtma qilish')
+@intents.intent('reserve')
+@timed
 async def make_booking(message: Message):
     chat_id = message.chat.id
-    lang = db.get_user_language(chat_id)
-    db.insert_categories()
-    await message.answer(langs[lang]['category'], reply_markup=generate_category_menu(lang))
+    lang = await db.get_user_language(chat_id)
+    await message.answer(langs[lang]['category'], reply_markup=await generate_category_menu(lang))
 
 
-@dp.callback_query_handler(lambda call: call.data.startswith('category_'))
-async def ask_period(call: CallbackQuery):
+@router.callback('category')
+@timed
+async def ask_period(call: CallbackQuery, category):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
-    category = call.data.split('_')[1]
+    lang = await db.get_user_language(chat_id)
     await bot.edit_message_text(
         langs[lang]['period'],
         chat_id,
         call.message.message_id,
-        reply_markup=generate_period_buttons(lang=lang, category=category)
+        reply_markup=await generate_period_buttons(lang=lang, category=category)
     )
 
 
-@dp.callback_query_handler(lambda call: 'main_menu' in call.data)
+@router.callback('main_menu')
+@timed
 async def return_to_main_menu(call: CallbackQuery):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     message_id = call.message.message_id
     await bot.edit_message_text(chat_id=chat_id, message_id=message_id,
-                                text=langs[lang]['category'], reply_markup=generate_category_menu(lang))
+                                text=langs[lang]['category'], reply_markup=await generate_category_menu(lang))
 
 
-calendar_callback = CallbackData('calendar', 'action', 'year', 'month', 'day', 'category')
-
-
-@dp.callback_query_handler(calendar_callback.filter(action=['day']))
-async def select_date(call: CallbackQuery, callback_data: dict):
+@router.callback('calendar:day')
+@timed
+async def select_date(call: CallbackQuery, year, month, day, category_id):
     chat_id = call.message.chat.id
     message_id = call.message.message_id
-    year = int(callback_data['year'])
-    month = int(callback_data['month'])
-    day = int(callback_data['day'])
-    category_id = callback_data['category']
 
-    date = datetime(year, month, day).date()
-    db.get_date(category_id, date, chat_id)
+    date = datetime(int(year), int(month), int(day)).date()
+    drafts.set(chat_id, {'category_id': int(category_id), 'date': date.strftime('%Y-%m-%d')})
 
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     await bot.edit_message_text(chat_id=chat_id, message_id=message_id,
                                 text=f"{langs[lang]['date_selected']} {date.strftime('%Y-%m-%d')}")
     await bot.send_message(chat_id, langs[lang]['time'])
     await call.answer()
 
 
-@dp.callback_query_handler(calendar_callback.filter(action=['prev_month', 'next_month']))
-async def change_month(call: CallbackQuery, callback_data: dict):
-    year = int(callback_data['year'])
-    month = int(callback_data['month'])
-    category = callback_data['category']
-    lang = db.get_user_language(call.message.chat.id)
+@router.callback('calendar:prev_month', 'calendar:next_month')
+@timed
+async def change_month(call: CallbackQuery, year, month, day, category):
+    year = int(year)
+    month = int(month)
+    lang = await db.get_user_language(call.message.chat.id)
 
     await bot.edit_message_text(
         langs[lang]['period'],
         call.message.chat.id,
         call.message.message_id,
-        reply_markup=generate_period_buttons(lang=lang, year=year, month=month, category=category)
+        reply_markup=await generate_period_buttons(lang=lang, year=year, month=month, category=category)
     )
     await call.answer()
 
 
 @dp.message_handler(regexp='^(?:[01]\d|2[0-3]):[0-5]\d$')
+@timed
 async def get_time_ask_people(message: Message):
     chat_id = message.chat.id
-    lang = db.get_user_language(chat_id)
-    time = message.text
-    db.update_time(time, chat_id)
+    lang = await db.get_user_language(chat_id)
+    draft = drafts.get(chat_id)
+    if not draft:
+        await message.answer(langs[lang]['booking_error'])
+        return
+    draft['time'] = message.text
+    drafts.set(chat_id, draft)
     await message.answer(langs[lang]['people'], reply_markup=generate_calculator_people(lang))
 
 
-@dp.callback_query_handler(lambda call: 'back' in call.data)
+@router.callback('back')
+@timed
 async def return_to_time(call: CallbackQuery):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     message_id = call.message.message_id
     await bot.delete_message(chat_id, message_id)
     await bot.send_message(chat_id, langs[lang]['time'])
 
 
-@dp.callback_query_handler(lambda call: 'plus' in call.data)
-async def increase_people(call: CallbackQuery):
+@router.callback('plus')
+@timed
+async def increase_people(call: CallbackQuery, quantity):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
-    _, quantity = call.data.split('_')
+    lang = await db.get_user_language(chat_id)
     quantity = int(quantity)
     quantity += 1
     message_id = call.message.message_id
@@ -166,11 +189,11 @@ async def increase_people(call: CallbackQuery):
                                 reply_markup=generate_calculator_people(lang=lang, c=quantity))
 
 
-@dp.callback_query_handler(lambda call: 'minus' in call.data)
-async def decrease_people(call: CallbackQuery):
+@router.callback('minus')
+@timed
+async def decrease_people(call: CallbackQuery, quantity):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
-    _, quantity = call.data.split('_')
+    lang = await db.get_user_language(chat_id)
     quantity = int(quantity)
     message_id = call.message.message_id
     if quantity <= 1:
@@ -182,57 +205,73 @@ async def decrease_people(call: CallbackQuery):
                                     reply_markup=generate_calculator_people(lang=lang, c=quantity))
 
 
-@dp.callback_query_handler(lambda call: 'reserve' in call.data)
-async def check_availability(call: CallbackQuery):
+@router.callback('reserve')
+@timed
+async def check_availability(call: CallbackQuery, quantity):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
-    message_id = call.message.message_id
-    _, quantity = call.data.split('_')
-    quantity = int(quantity)
-    last_booking = db.get_last_booking(chat_id)
-    if not last_booking:
+    lang = await db.get_user_language(chat_id)
+    draft = drafts.get(chat_id)
+    if not draft or 'time' not in draft:
         await bot.send_message(chat_id, langs[lang]['booking_error'])
         await call.answer()
         return
 
-    category_id = last_booking['category_id']
-    date = last_booking['date']
-    time = last_booking['time']
+    draft['amount_people'] = int(quantity)
+    await complete_booking(call, lang, draft)
 
-    if db.check_availability(category_id, date, time):
-        db.update_amount_people(chat_id, quantity)
-        await bot.send_message(chat_id, langs[lang]['booking_successful'])
-    else:
-        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=langs[lang]['booking_unavailable'])
-        await bot.send_message(chat_id, langs[lang]['choose_alternative'],
-                               reply_markup=generate_alternative_times(date, category_id, lang))
-    await call.answer()
 
+@router.callback('alternative')
+@timed
+async def select_alternative_time(call: CallbackQuery, hours, minutes):
+    chat_id = call.message.chat.id
+    lang = await db.get_user_language(chat_id)
+    draft = drafts.get(chat_id)
+    if not draft or 'amount_people' not in draft:
+        await bot.send_message(chat_id, langs[lang]['booking_error'])
+        await call.answer()
+        return
 
-@dp.callback_query_handler(lambda call: call.data.startswith('alternative_'))
-async def select_alternative_time(call: CallbackQuery):
+    draft['time'] = f'{hours}:{minutes}'
+    await complete_booking(call, lang, draft)
+
+
+async def complete_booking(call: CallbackQuery, lang, draft):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
-    alternative_time = call.data.split('_')[1]
-    db.update_time(alternative_time, chat_id)
-    await bot.send_message(chat_id, langs[lang]['booking_successful'])
+    message_id = call.message.message_id
+    booking_id, _ = await db.reserve(chat_id, draft['category_id'], draft['date'], draft['time'],
+                                     draft['amount_people'])
+    if booking_id:
+        drafts.pop(chat_id)
+        start_at = to_start_at(draft['date'], draft['time'])
+        if not scheduler.schedule(booking_id, start_at, now=to_timestamp(datetime.now())):
+            # The confirmation below is all the reminder a booking this close gets, also after a restart
+            await db.mark_reminders_sent([booking_id])
+        await bot.send_message(chat_id, langs[lang]['booking_successful'])
+    else:
+        drafts.set(chat_id, draft)
+        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=langs[lang]['booking_unavailable'])
+        markup = await generate_alternative_times(draft['date'], draft['category_id'], lang)
+        await bot.send_message(chat_id, langs[lang]['choose_alternative'], reply_markup=markup)
     await call.answer()
 
 
 @dp.message_handler(commands=['cancel'])
+@timed
 async def command_cancel(message: Message):
     chat_id = message.chat.id
-    lang = db.get_user_language(chat_id)
-    await bot.send_message(chat_id, langs[lang]['choose_booking'], reply_markup=generate_all_reserving(chat_id))
+    lang = await db.get_user_language(chat_id)
+    await bot.send_message(chat_id, langs[lang]['choose_booking'],
+                           reply_markup=await generate_all_reserving(chat_id))
 
 
-@dp.callback_query_handler(lambda call: call.data.startswith('view-booking_'))
-async def view_booking(call: CallbackQuery):
+@router.callback('view-booking')
+@timed
+async def view_booking(call: CallbackQuery, booking_id):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     message_id = call.message.message_id
-    booking_id = int(call.data.split('_')[1])
-    booking = db.get_booking_by_id(booking_id)
+    booking_id = int(booking_id)
+    booking = await db.get_booking_by_id(booking_id)
     if booking:
         text = (f"{langs[lang]['booking_name']}: {booking['category_name']}\n"
                 f"{langs[lang]['booking_date']}: {booking['date']}\n"
@@ -244,63 +283,136 @@ async def view_booking(call: CallbackQuery):
         await bot.send_message(chat_id, langs[lang]['booking_not_found'])
 
 
-@dp.callback_query_handler(lambda call: call.data.startswith('cancel_'))
-async def cancel_booking(call: CallbackQuery):
+@router.callback('cancel')
+@timed
+async def cancel_booking(call: CallbackQuery, booking_id):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     message_id = call.message.message_id
-    booking_id = int(call.data.split('_')[1])
-    db.delete_booking(booking_id)
+    booking_id = int(booking_id)
+    await db.delete_booking(booking_id)
+    scheduler.cancel(booking_id)
     await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=langs[lang]['booking_cancelled'])
-    await bot.send_message(chat_id, langs[lang]['choose_booking'], reply_markup=generate_all_reserving(chat_id))
+    await bot.send_message(chat_id, langs[lang]['choose_booking'],
+                           reply_markup=await generate_all_reserving(chat_id))
 
 
-@dp.callback_query_handler(lambda call: call.data.startswith('exit'))
+@router.callback('bookings:prev')
+@timed
+async def previous_bookings_page(call: CallbackQuery, start_at, booking_id):
+    await change_bookings_page(call, before=(int(start_at), int(booking_id)))
+
+
+@router.callback('bookings:next')
+@timed
+async def next_bookings_page(call: CallbackQuery, start_at, booking_id):
+    await change_bookings_page(call, after=(int(start_at), int(booking_id)))
+
+
+async def change_bookings_page(call: CallbackQuery, before=None, after=None):
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    markup = await generate_all_reserving(chat_id, before=before, after=after)
+    await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=markup)
+    await call.answer()
+
+
+@router.callback('exit')
+@timed
 async def back_to_bookings(call: CallbackQuery):
     chat_id = call.message.chat.id
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     message_id = call.message.message_id
     await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=langs[lang]['choose_booking'],
-                                reply_markup=generate_all_reserving(chat_id))
+                                reply_markup=await generate_all_reserving(chat_id))
 
 
-@dp.message_handler(regexp='Settings|Настройки|Sozlamalar')
+@intents.intent('settings')
+@timed
 async def settings(message: Message):
     chat_id = message.chat.id
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     await message.answer(langs[lang]['choose_option'], reply_markup=generate_settings(lang))
 
 
-@dp.message_handler(regexp='Change language|Сменить язык|Tilni ozgartiring')
+@intents.intent('change_lang')
+@timed
 async def change_language(message: Message):
     chat_id = message.chat.id
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     await message.answer(langs[lang]['select_lang'], reply_markup=choose_lang_button())
 
 
-@dp.message_handler(regexp='⬅ Back|⬅ Назад|⬅ Orqaga')
-async def change_language(message: Message):
+@intents.intent('back')
+@timed
+async def back_to_menu(message: Message):
     chat_id = message.chat.id
-    lang = db.get_user_language(chat_id)
+    lang = await db.get_user_language(chat_id)
     await message.answer(langs[lang]['choose_option'], reply_markup=generate_reserve_button(lang))
 
 
-async def send_reminders():
-    while True:
-        now = datetime.now()
-        reminder_time = now + timedelta(hours=24)
-        bookings = db.get_bookings_for_reminder(reminder_time)
+scheduler = ReminderScheduler(ReminderSender(bot, db))
+
+
+async def log_query_report():
+    logging.warning('Top queries by total time:\n%s', await db.query_report())
 
-        for booking in bookings:
-            chat_id = booking[1]
-            lang = db.get_user_language(chat_id)
-            await bot.send_message(chat_id, f"{langs[lang]['reminder']}: {booking[5]} - {booking[3]} {booking[4]}")
-            db.mark_reminder_sent(booking[0])
-        await asyncio.sleep(3600)
+
+async def archive_periodically():
+    while True:
+        before = datetime.now() - timedelta(days=config.ARCHIVE_AFTER_DAYS)
+        try:
+            archived = await db.archive_bookings(before)
+        except Exception:
+            logging.exception('Failed to archive bookings')
+        else:
+            if archived:
+                logging.info('Archived %s bookings that started before %s', archived, before)
+        await asyncio.sleep(config.ARCHIVE_INTERVAL)
 
 
 async def on_startup(dp):
-    db.create_booking_table()
-    asyncio.create_task(send_reminders())
+    await db.migrate()
+    await start_metrics()
+    asyncio.create_task(db.flush_periodically())
+    if config.STORAGE == 'sqlite' and config.SLOW_QUERY_MS and hasattr(signal, 'SIGUSR1'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1,
+                                                      lambda: asyncio.create_task(log_query_report()))
+    for booking_id, start_at in await db.get_pending_reminders(datetime.now()):
+        scheduler.schedule(booking_id, start_at)
+    asyncio.create_task(scheduler.run())
+    if config.ARCHIVE_AFTER_DAYS:
+        asyncio.create_task(archive_periodically())
+
+
+async def on_shutdown(dp):
+    await db.close()
+
+
+async def migrate_storage():
+    await db.migrate()
+    await db.close()
+
 
-executor.start_polling(dp, on_startup=on_startup)
+def run_worker(index, updates, reminder_events):
+    if index == 0:
+        async def on_worker_startup(dp):
+            await on_startup(dp)
+            asyncio.create_task(scheduler.listen(reminder_events))
+
+        webhook.run_worker(dp, updates, on_startup=on_worker_startup, on_shutdown=on_shutdown)
+    else:
+        async def on_worker_startup(dp):
+            await start_metrics(index)
+            asyncio.create_task(db.flush_periodically())
+
+        scheduler.forward = reminder_events
+        webhook.run_worker(dp, updates, on_startup=on_worker_startup, on_shutdown=on_shutdown)
+
+
+if __name__ == '__main__':
+    if config.BOT_MODE == 'webhook':
+        asyncio.run(migrate_storage())
+        webhook.start_webhook(bot, run_worker)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
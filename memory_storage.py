@@ -0,0 +1,206 @@
+import itertools
+
+from database import month_range, to_start_at, to_timestamp
+from schedules import Schedules
+
+CATEGORIES = [
+    (1, 'Air tickets', 'Авиабилеты', 'Aviabiletlar', 5, '09:00', '21:00', 60),
+    (2, 'Hotels', 'Отели и гостиницы', 'Mehmonxonalar', 10, '09:00', '21:00', 60),
+    (3, 'Restaurants', 'Столик в рестаране', 'Restoranlar', 20, '09:00', '21:00', 60),
+    (4, 'Museums', 'Музеи', 'Muzeylar', 10, '09:00', '21:00', 60),
+    (5, 'Special-events', 'Special-events', 'Special-events', 5, '09:00', '21:00', 60),
+]
+
+
+class MemoryStorage:
+    # Keeps everything in dicts on the event loop thread, so no method awaits anything and each
+    # one runs atomically. Rows have the same shape as the SQLite backend returns; nothing survives
+    # a restart, which makes it meant for tests and benchmarks
+
+    def __init__(self):
+        self.users = {}
+        self.categories = []
+        self.categories_version = 0
+        self.bookings = {}
+        self.user_ids = itertools.count(1)
+        self.booking_ids = itertools.count(1)
+        self.overrides = {}
+        self.schedules = Schedules()
+        self.archive = {}
+
+    async def migrate(self):
+        if not self.categories:
+            self.categories = list(CATEGORIES)
+        self.categories_version += 1
+        self.compile_schedules()
+
+    def compile_schedules(self):
+        self.schedules = Schedules([(category[0], *category[4:]) for category in self.categories],
+                                   [key + override for key, override in self.overrides.items()])
+
+    async def set_category_schedule(self, category_id, capacity, opens_at, closes_at, slot_minutes):
+        self.categories = [category[:4] + (capacity, opens_at, closes_at, slot_minutes)
+                           if category[0] == category_id else category for category in self.categories]
+        self.compile_schedules()
+
+    async def set_schedule_override(self, category_id, date, closed=False, capacity=None, opens_at=None,
+                                    closes_at=None, slot_minutes=None):
+        self.overrides[(category_id, str(date))] = (closed, capacity, opens_at, closes_at, slot_minutes)
+        self.compile_schedules()
+
+    async def delete_schedule_override(self, category_id, date):
+        self.overrides.pop((category_id, str(date)), None)
+        self.compile_schedules()
+
+    async def close(self):
+        pass
+
+    async def flush_writes(self):
+        pass
+
+    async def flush_periodically(self, interval=None):
+        pass
+
+    async def get_user_by_chat_id(self, chat_id):
+        return self.users.get(chat_id)
+
+    async def first_register_user(self, chat_id, full_name):
+        self.users[chat_id] = (next(self.user_ids), chat_id, full_name, None, None)
+
+    async def update_user_to_finish_register(self, chat_id, phone):
+        user = self.users.get(chat_id)
+        if user:
+            self.users[chat_id] = user[:3] + (phone,) + user[4:]
+
+    async def set_user_language(self, chat_id, lang):
+        user = self.users.get(chat_id)
+        if user:
+            self.users[chat_id] = user[:4] + (lang,)
+        else:
+            self.users[chat_id] = (next(self.user_ids), chat_id, None, None, lang)
+
+    async def get_user_language(self, chat_id):
+        user = self.users.get(chat_id)
+        if user:
+            return user[4]
+        return None
+
+    async def get_all_categories(self):
+        return list(self.categories)
+
+    def slot_occupancy(self, category_id, date):
+        occupancy = {}
+        for booking in self.bookings.values():
+            if booking['category_id'] == int(category_id) and booking['date'] == str(date) \
+                    and booking['amount_people'] is not None:
+                occupancy[booking['time']] = occupancy.get(booking['time'], 0) + 1
+        return occupancy
+
+    async def reserve(self, chat_id, category_id, date, time, amount_people):
+        schedule = self.schedules.get(int(category_id), date)
+        if not schedule.is_open(time):
+            return None, 0
+        max_capacity = schedule.capacity
+        booked = self.slot_occupancy(category_id, date).get(time, 0)
+        if booked >= max_capacity:
+            return None, max_capacity - booked
+        booking_id = next(self.booking_ids)
+        self.bookings[booking_id] = {
+            'booking_id': booking_id,
+            'category_id': int(category_id),
+            'date': str(date),
+            'time': time,
+            'amount_people': amount_people,
+            'chat_id': chat_id,
+            'reminder_sent': False,
+            'start_at': to_start_at(date, time),
+        }
+        return booking_id, max_capacity - booked - 1
+
+    async def get_available_times(self, date, category_id):
+        schedule = self.schedules.get(int(category_id), date)
+        occupancy = self.slot_occupancy(category_id, date)
+        return [time for time in schedule.slots if occupancy.get(time, 0) < schedule.capacity]
+
+    async def check_availability(self, category_id, date, time):
+        schedule = self.schedules.get(int(category_id), date)
+        if not schedule.is_open(time):
+            return False
+        occupancy = self.slot_occupancy(category_id, date)
+        return occupancy.get(time, 0) < schedule.capacity
+
+    async def get_month_availability(self, category_id, year, month):
+        start, end = month_range(int(year), int(month))
+        counts = {}
+        for booking in self.bookings.values():
+            if booking['category_id'] == int(category_id) and start <= booking['date'] < end \
+                    and booking['amount_people'] is not None:
+                slot = (booking['date'], booking['time'])
+                counts[slot] = counts.get(slot, 0) + 1
+        rows = [(date, time, count) for (date, time), count in counts.items()]
+        return self.schedules.remaining_capacity(int(category_id), int(year), int(month), rows)
+
+    async def get_upcoming_bookings(self, chat_id, now, limit, after=None, before=None):
+        now = to_timestamp(now)
+        rows = sorted((booking['start_at'], booking['booking_id'], booking['date'], booking['time'])
+                      for booking in self.bookings.values()
+                      if booking['chat_id'] == chat_id and booking['start_at'] >= now
+                      and booking['amount_people'] is not None)
+        if before:
+            rows = [row for row in rows if row[:2] < tuple(before)][-limit:]
+        else:
+            rows = [row for row in rows if row[:2] > tuple(after or (0, 0))][:limit]
+        return [(booking_id, date, time, start_at) for start_at, booking_id, date, time in rows]
+
+    async def get_booking_by_id(self, booking_id):
+        booking = self.bookings.get(booking_id)
+        if booking:
+            return {
+                'booking_id': booking_id,
+                'date': booking['date'],
+                'time': booking['time'],
+                'amount_people': booking['amount_people'],
+                'category_name': self.category_name(booking['category_id']),
+            }
+        return None
+
+    def category_name(self, category_id):
+        for category in self.categories:
+            if category[0] == category_id:
+                return category[1]
+        return None
+
+    async def delete_booking(self, booking_id):
+        self.bookings.pop(booking_id, None)
+
+    async def archive_bookings(self, before, batch_size=None):
+        before = to_timestamp(before)
+        archived = [booking_id for booking_id, booking in self.bookings.items() if booking['start_at'] < before]
+        for booking_id in archived:
+            self.archive[booking_id] = self.bookings.pop(booking_id)
+        return len(archived)
+
+    async def get_pending_reminders(self, now):
+        now = to_timestamp(now)
+        return [(booking['booking_id'], booking['start_at']) for booking in self.bookings.values()
+                if not booking['reminder_sent'] and booking['start_at'] > now
+                and booking['amount_people'] is not None]
+
+    async def get_bookings_for_reminder(self, booking_ids):
+        bookings = []
+        for booking_id in booking_ids:
+            booking = self.bookings.get(booking_id)
+            if not booking or booking['reminder_sent']:
+                continue
+            user = self.users.get(booking['chat_id'])
+            bookings.append((booking_id, booking['chat_id'], booking['category_id'], booking['date'],
+                             booking['time'], self.category_name(booking['category_id']), user[4] if user else None))
+        return bookings
+
+    async def mark_reminders_sent(self, booking_ids):
+        for booking_id in booking_ids:
+            if booking_id in self.bookings:
+                self.bookings[booking_id]['reminder_sent'] = True
+
+    async def release_reminders(self, booking_ids):
+        pass
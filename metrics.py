@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiogram import Bot
+from aiohttp import web
+
+import config
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f'{name}{format_labels(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+registry = Registry()
+
+
+def timed(handler):
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            registry.inc('handler_errors_total', handler=handler.__name__)
+            raise
+        finally:
+            registry.observe('handler_latency_seconds', time.perf_counter() - started, handler=handler.__name__)
+    return wrapper
+
+
+class MeteredBot(Bot):
+    async def request(self, method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception:
+            registry.inc('telegram_errors_total', method=method)
+            raise
+        finally:
+            registry.observe('telegram_request_seconds', time.perf_counter() - started, method=method)
+
+
+async def serve_metrics(request):
+    return web.Response(text=registry.render(), content_type='text/plain')
+
+
+async def dump_metrics(path, interval):
+    while True:
+        await asyncio.sleep(interval)
+        with open(path, 'w') as file:
+            file.write(registry.render())
+
+
+async def start_metrics(worker=0):
+    # In webhook mode every worker process keeps its own registry, served on its own port / file
+    if config.METRICS_PORT:
+        app = web.Application()
+        app.router.add_get('/metrics', serve_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, port=config.METRICS_PORT + worker).start()
+    if config.METRICS_FILE:
+        path = f'{config.METRICS_FILE}.{worker}' if worker else config.METRICS_FILE
+        asyncio.create_task(dump_metrics(path, config.METRICS_DUMP_INTERVAL))
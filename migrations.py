@@ -0,0 +1,153 @@
+# Ordered schema migrations. PRAGMA user_version stores how many of them have been applied,
+# so every step runs exactly once per database file. Only ever append new steps.
+
+
+def create_tables(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users(
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER UNIQUE,
+        full_name TEXT,
+        phone TEXT,
+        language TEXT
+        )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS categories(
+    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category_name VARCHAR(100),
+    category_name_ru VARCHAR(100) NOT NULL,
+    category_name_uz VARCHAR(100) NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS booking(
+    booking_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category_id INTEGER REFERENCES categories(category_id),
+    date DATE,
+    time TEXT,
+    amount_people INTEGER,
+    chat_id INTEGER REFERENCES users(chat_id),
+    reminder_sent BOOLEAN DEFAULT 0,
+    start_at INTEGER
+    )
+    ''')
+
+
+def add_booking_start_at(cursor):
+    columns = cursor.execute('PRAGMA table_info(booking)').fetchall()
+    if any(column[1] == 'start_at' for column in columns):
+        return
+    cursor.execute('''
+    ALTER TABLE booking ADD COLUMN start_at INTEGER
+    ''')
+    cursor.execute('''
+    UPDATE booking
+    SET start_at = CAST(strftime('%s', date || ' ' || time) AS INTEGER)
+    WHERE start_at IS NULL AND time IS NOT NULL
+    ''')
+
+
+def create_booking_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_booking_slot ON booking(category_id, date, time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_booking_chat ON booking(chat_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_booking_reminder ON booking(start_at) WHERE reminder_sent = 0')
+
+
+def seed_categories(cursor):
+    if cursor.execute('SELECT COUNT(*) FROM categories').fetchone()[0]:
+        return
+    cursor.execute('''
+    INSERT INTO categories (category_name, category_name_ru, category_name_uz) VALUES
+    ('Air tickets', 'Авиабилеты', 'Aviabiletlar'),
+    ('Hotels', 'Отели и гостиницы', 'Mehmonxonalar'),
+    ('Restaurants', 'Столик в рестаране', 'Restoranlar'),
+    ('Museums', 'Музеи', 'Muzeylar'),
+    ('Special-events', 'Special-events', 'Special-events')
+    ''')
+
+
+def index_bookings_by_chat_and_start(cursor):
+    # Serves the keyset-paginated booking list; it also covers every lookup by chat_id alone
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_booking_chat_start ON booking(chat_id, start_at)')
+    cursor.execute('DROP INDEX IF EXISTS idx_booking_chat')
+
+
+def add_category_schedules(cursor):
+    # Capacity and opening hours used to be hard-coded per category_id; these are the same values.
+    # A schedule_overrides row replaces them for one date, NULL columns keep the category's value
+    cursor.execute('ALTER TABLE categories ADD COLUMN capacity INTEGER NOT NULL DEFAULT 5')
+    cursor.execute("ALTER TABLE categories ADD COLUMN opens_at TEXT NOT NULL DEFAULT '09:00'")
+    cursor.execute("ALTER TABLE categories ADD COLUMN closes_at TEXT NOT NULL DEFAULT '21:00'")
+    cursor.execute('ALTER TABLE categories ADD COLUMN slot_minutes INTEGER NOT NULL DEFAULT 60')
+    cursor.execute('''
+    UPDATE categories
+    SET capacity = CASE category_id WHEN 2 THEN 10 WHEN 3 THEN 20 WHEN 4 THEN 10 ELSE 5 END
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schedule_overrides(
+    category_id INTEGER NOT NULL REFERENCES categories(category_id),
+    date DATE NOT NULL,
+    closed BOOLEAN NOT NULL DEFAULT 0,
+    capacity INTEGER,
+    opens_at TEXT,
+    closes_at TEXT,
+    slot_minutes INTEGER,
+    PRIMARY KEY (category_id, date)
+    )
+    ''')
+
+
+def create_booking_archive(cursor):
+    # Bookings past the retention horizon are moved here, out of the table the bot queries
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS booking_archive(
+    booking_id INTEGER PRIMARY KEY,
+    category_id INTEGER,
+    date DATE,
+    time TEXT,
+    amount_people INTEGER,
+    chat_id INTEGER,
+    reminder_sent BOOLEAN,
+    start_at INTEGER,
+    archived_at INTEGER
+    )
+    ''')
+
+
+def index_bookings_by_start(cursor):
+    # Lets the archive job find old bookings with a range search. Drafts that never got a time have
+    # no start_at and would need a scan, so they are archived here once; reserve() always sets it
+    cursor.execute('''
+    INSERT OR REPLACE INTO booking_archive
+    (booking_id, category_id, date, time, amount_people, chat_id, reminder_sent, start_at, archived_at)
+    SELECT booking_id, category_id, date, time, amount_people, chat_id, reminder_sent, start_at,
+           CAST(strftime('%s', 'now', 'localtime') AS INTEGER)
+    FROM booking
+    WHERE start_at IS NULL
+    ''')
+    cursor.execute('DELETE FROM booking WHERE start_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_booking_start ON booking(start_at)')
+
+
+MIGRATIONS = [
+    create_tables,
+    add_booking_start_at,
+    create_booking_indexes,
+    seed_categories,
+    index_bookings_by_chat_and_start,
+    add_category_schedules,
+    create_booking_archive,
+    index_bookings_by_start,
+]
+
+
+def migrate(connection):
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        with connection:
+            cursor = connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            step(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+    return len(MIGRATIONS)
@@ -0,0 +1,433 @@
+import asyncio
+import time
+from datetime import datetime
+
+import asyncpg
+
+from database import SHARED_CACHE_TTL, month_range, to_start_at, to_timestamp
+from schedules import Schedules
+
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 10
+ARCHIVE_BATCH_SIZE = 500
+
+# Same schema as migrations.py ends up with for SQLite. schema_version stores how many steps have
+# been applied; only ever append new steps
+MIGRATIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS users(
+        user_id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT UNIQUE,
+        full_name TEXT,
+        phone TEXT,
+        language TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS categories(
+        category_id SERIAL PRIMARY KEY,
+        category_name VARCHAR(100),
+        category_name_ru VARCHAR(100) NOT NULL,
+        category_name_uz VARCHAR(100) NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS booking(
+        booking_id BIGSERIAL PRIMARY KEY,
+        category_id INTEGER REFERENCES categories(category_id),
+        date TEXT,
+        time TEXT,
+        amount_people INTEGER,
+        chat_id BIGINT REFERENCES users(chat_id),
+        reminder_sent BOOLEAN NOT NULL DEFAULT FALSE,
+        start_at BIGINT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_booking_slot ON booking(category_id, date, time)',
+    'CREATE INDEX IF NOT EXISTS idx_booking_chat_start ON booking(chat_id, start_at)',
+    'CREATE INDEX IF NOT EXISTS idx_booking_reminder ON booking(start_at) WHERE NOT reminder_sent',
+    '''
+    INSERT INTO categories (category_name, category_name_ru, category_name_uz)
+    SELECT * FROM (VALUES
+        ('Air tickets', 'Авиабилеты', 'Aviabiletlar'),
+        ('Hotels', 'Отели и гостиницы', 'Mehmonxonalar'),
+        ('Restaurants', 'Столик в рестаране', 'Restoranlar'),
+        ('Museums', 'Музеи', 'Muzeylar'),
+        ('Special-events', 'Special-events', 'Special-events')
+    ) AS seed
+    WHERE NOT EXISTS (SELECT 1 FROM categories)
+    ''',
+    '''
+    ALTER TABLE categories
+        ADD COLUMN capacity INTEGER NOT NULL DEFAULT 5,
+        ADD COLUMN opens_at TEXT NOT NULL DEFAULT '09:00',
+        ADD COLUMN closes_at TEXT NOT NULL DEFAULT '21:00',
+        ADD COLUMN slot_minutes INTEGER NOT NULL DEFAULT 60
+    ''',
+    '''
+    UPDATE categories
+    SET capacity = CASE category_id WHEN 2 THEN 10 WHEN 3 THEN 20 WHEN 4 THEN 10 ELSE 5 END
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS schedule_overrides(
+        category_id INTEGER NOT NULL REFERENCES categories(category_id),
+        date TEXT NOT NULL,
+        closed BOOLEAN NOT NULL DEFAULT FALSE,
+        capacity INTEGER,
+        opens_at TEXT,
+        closes_at TEXT,
+        slot_minutes INTEGER,
+        PRIMARY KEY (category_id, date)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS booking_archive(
+        booking_id BIGINT PRIMARY KEY,
+        category_id INTEGER,
+        date TEXT,
+        time TEXT,
+        amount_people INTEGER,
+        chat_id BIGINT,
+        reminder_sent BOOLEAN,
+        start_at BIGINT,
+        archived_at BIGINT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_booking_start ON booking(start_at)',
+    # SQLite never turns foreign_keys on and the memory backend has no constraints, so a booking
+    # by a chat that has no users row has to be accepted here too
+    'ALTER TABLE booking DROP CONSTRAINT IF EXISTS booking_chat_id_fkey',
+]
+
+# Arbitrary key for the advisory lock that serialises migrations between bot processes
+MIGRATION_LOCK = 7_302_145
+
+
+class PostgresStorage:
+    # Every bot process talks to the same server, so unlike the SQLite backend nothing is cached
+    # or written behind here: another process may change any row at any time
+
+    def __init__(self, dsn, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self.pool_lock = asyncio.Lock()
+        self.categories_version = 0
+        self.schedules = None
+        self.schedules_loaded = 0
+
+    async def get_pool(self):
+        async with self.pool_lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        return self.pool
+
+    async def migrate(self):
+        pool = await self.get_pool()
+        async with pool.acquire() as connection, connection.transaction():
+            await connection.execute('SELECT pg_advisory_xact_lock($1)', MIGRATION_LOCK)
+            await connection.execute('CREATE TABLE IF NOT EXISTS schema_version(version INTEGER NOT NULL)')
+            version = await connection.fetchval('SELECT version FROM schema_version')
+            if version is None:
+                version = 0
+                await connection.execute('INSERT INTO schema_version(version) VALUES (0)')
+            for sql in MIGRATIONS[version:]:
+                await connection.execute(sql)
+            await connection.execute('UPDATE schema_version SET version = $1', len(MIGRATIONS))
+        self.categories_version += 1
+        self.schedules = None
+        return len(MIGRATIONS)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def flush_writes(self):
+        pass
+
+    async def flush_periodically(self, interval=None):
+        pass
+
+    async def fetch(self, sql, *args):
+        pool = await self.get_pool()
+        return [tuple(row) for row in await pool.fetch(sql, *args)]
+
+    async def fetchrow(self, sql, *args):
+        pool = await self.get_pool()
+        row = await pool.fetchrow(sql, *args)
+        return tuple(row) if row else None
+
+    async def execute(self, sql, *args):
+        pool = await self.get_pool()
+        await pool.execute(sql, *args)
+
+    async def get_user_by_chat_id(self, chat_id):
+        sql = '''
+        SELECT * FROM users WHERE chat_id = $1
+        '''
+        return await self.fetchrow(sql, chat_id)
+
+    async def first_register_user(self, chat_id, full_name):
+        sql = '''
+        INSERT INTO users(chat_id, full_name) VALUES ($1, $2)
+        '''
+        await self.execute(sql, chat_id, full_name)
+
+    async def update_user_to_finish_register(self, chat_id, phone):
+        sql = '''
+        UPDATE users SET phone = $1
+        WHERE chat_id = $2
+        '''
+        await self.execute(sql, phone, chat_id)
+
+    async def set_user_language(self, chat_id, lang):
+        sql = '''
+        INSERT INTO users (chat_id, language) VALUES ($1, $2)
+        ON CONFLICT (chat_id) DO UPDATE SET language = excluded.language
+        '''
+        await self.execute(sql, chat_id, lang)
+
+    async def get_user_language(self, chat_id):
+        sql = '''
+        SELECT language FROM users WHERE chat_id = $1
+        '''
+        user = await self.fetchrow(sql, chat_id)
+        if user:
+            return user[0]
+        return None
+
+    async def get_all_categories(self):
+        sql = '''
+        SELECT * FROM categories ORDER BY category_id
+        '''
+        return await self.fetch(sql)
+
+    async def load_schedules(self):
+        categories = await self.fetch('''
+        SELECT category_id, capacity, opens_at, closes_at, slot_minutes
+        FROM categories
+        ''')
+        overrides = await self.fetch('''
+        SELECT category_id, date, closed, capacity, opens_at, closes_at, slot_minutes
+        FROM schedule_overrides
+        ''')
+        self.schedules = Schedules(categories, overrides)
+        self.schedules_loaded = time.monotonic()
+        return self.schedules
+
+    async def get_schedules(self):
+        # Other processes edit schedules too, so the compiled copy expires like the SQLite one does
+        # in shared mode
+        if self.schedules is None or time.monotonic() - self.schedules_loaded > SHARED_CACHE_TTL:
+            return await self.load_schedules()
+        return self.schedules
+
+    async def get_schedule(self, category_id, date):
+        schedules = await self.get_schedules()
+        return schedules.get(int(category_id), date)
+
+    async def set_category_schedule(self, category_id, capacity, opens_at, closes_at, slot_minutes):
+        sql = '''
+        UPDATE categories
+        SET capacity = $1, opens_at = $2, closes_at = $3, slot_minutes = $4
+        WHERE category_id = $5
+        '''
+        await self.execute(sql, capacity, opens_at, closes_at, slot_minutes, category_id)
+        self.schedules = None
+
+    async def set_schedule_override(self, category_id, date, closed=False, capacity=None, opens_at=None,
+                                    closes_at=None, slot_minutes=None):
+        sql = '''
+        INSERT INTO schedule_overrides(category_id, date, closed, capacity, opens_at, closes_at, slot_minutes)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT (category_id, date) DO UPDATE
+        SET closed = excluded.closed, capacity = excluded.capacity, opens_at = excluded.opens_at,
+            closes_at = excluded.closes_at, slot_minutes = excluded.slot_minutes
+        '''
+        await self.execute(sql, category_id, str(date), closed, capacity, opens_at, closes_at, slot_minutes)
+        self.schedules = None
+
+    async def delete_schedule_override(self, category_id, date):
+        sql = '''
+        DELETE FROM schedule_overrides
+        WHERE category_id = $1 AND date = $2
+        '''
+        await self.execute(sql, category_id, str(date))
+        self.schedules = None
+
+    async def reserve(self, chat_id, category_id, date, time, amount_people):
+        # The advisory lock serialises reservations of one slot across every bot process, so the
+        # count and the insert cannot interleave with another reservation of the same slot
+        category_id = int(category_id)
+        schedule = await self.get_schedule(category_id, date)
+        if not schedule.is_open(time):
+            return None, 0
+        max_capacity = schedule.capacity
+        pool = await self.get_pool()
+        async with pool.acquire() as connection, connection.transaction():
+            await connection.execute('SELECT pg_advisory_xact_lock(hashtext($1))', f'{category_id}:{date}:{time}')
+            booked = await connection.fetchval('''
+            SELECT COUNT(*)
+            FROM booking
+            WHERE category_id = $1 AND date = $2 AND time = $3 AND amount_people IS NOT NULL
+            ''', category_id, str(date), time)
+            if booked >= max_capacity:
+                return None, max_capacity - booked
+            booking_id = await connection.fetchval('''
+            INSERT INTO booking(category_id, date, time, amount_people, chat_id, start_at)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            RETURNING booking_id
+            ''', category_id, str(date), time, amount_people, chat_id, to_start_at(date, time))
+        return booking_id, max_capacity - booked - 1
+
+    async def get_slot_occupancy(self, category_id, date):
+        sql = '''
+        SELECT time, COUNT(*)
+        FROM booking
+        WHERE category_id = $1 AND date = $2 AND amount_people IS NOT NULL
+        GROUP BY time
+        '''
+        return dict(await self.fetch(sql, int(category_id), str(date)))
+
+    async def get_available_times(self, date, category_id):
+        schedule = await self.get_schedule(category_id, date)
+        occupancy = await self.get_slot_occupancy(category_id, date)
+        return [time for time in schedule.slots if occupancy.get(time, 0) < schedule.capacity]
+
+    async def check_availability(self, category_id, date, time):
+        schedule = await self.get_schedule(category_id, date)
+        if not schedule.is_open(time):
+            return False
+        occupancy = await self.get_slot_occupancy(category_id, date)
+        return occupancy.get(time, 0) < schedule.capacity
+
+    async def get_month_availability(self, category_id, year, month):
+        sql = '''
+        SELECT date, time, COUNT(*)
+        FROM booking
+        WHERE category_id = $1 AND date >= $2 AND date < $3 AND amount_people IS NOT NULL
+        GROUP BY date, time
+        '''
+        rows = await self.fetch(sql, int(category_id), *month_range(int(year), int(month)))
+        schedules = await self.get_schedules()
+        return schedules.remaining_capacity(int(category_id), int(year), int(month), rows)
+
+    async def get_upcoming_bookings(self, chat_id, now, limit, after=None, before=None):
+        if before:
+            sql = '''
+            SELECT booking_id, date, time, start_at
+            FROM booking
+            WHERE chat_id = $1 AND start_at >= $2 AND amount_people IS NOT NULL
+            AND (start_at, booking_id) < ($3, $4)
+            ORDER BY start_at DESC, booking_id DESC
+            LIMIT $5
+            '''
+            bookings = await self.fetch(sql, chat_id, to_timestamp(now), *before, limit)
+            return bookings[::-1]
+        sql = '''
+        SELECT booking_id, date, time, start_at
+        FROM booking
+        WHERE chat_id = $1 AND start_at >= $2 AND amount_people IS NOT NULL
+        AND (start_at, booking_id) > ($3, $4)
+        ORDER BY start_at, booking_id
+        LIMIT $5
+        '''
+        return await self.fetch(sql, chat_id, to_timestamp(now), *(after or (0, 0)), limit)
+
+    async def get_booking_by_id(self, booking_id):
+        sql = '''
+        SELECT b.booking_id, b.date, b.time, b.amount_people, c.category_name
+        FROM booking b
+        JOIN categories c ON b.category_id = c.category_id
+        WHERE b.booking_id = $1
+        '''
+        result = await self.fetchrow(sql, booking_id)
+        if result:
+            return {
+                'booking_id': result[0],
+                'date': result[1],
+                'time': result[2],
+                'amount_people': result[3],
+                'category_name': result[4]
+            }
+        return None
+
+    async def delete_booking(self, booking_id):
+        sql = '''
+        DELETE FROM booking
+        WHERE booking_id = $1
+        '''
+        await self.execute(sql, booking_id)
+
+    async def archive_bookings(self, before, batch_size=ARCHIVE_BATCH_SIZE):
+        # Moves bookings in batches of their own transaction; SKIP LOCKED leaves rows another
+        # process is working on for the next run. Autovacuum reclaims the space afterwards
+        sql = '''
+        WITH moved AS (
+            DELETE FROM booking
+            WHERE booking_id IN (
+                SELECT booking_id FROM booking
+                WHERE start_at < $1
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING booking_id, category_id, date, time, amount_people, chat_id, reminder_sent, start_at
+        )
+        INSERT INTO booking_archive
+        (booking_id, category_id, date, time, amount_people, chat_id, reminder_sent, start_at, archived_at)
+        SELECT *, $3 FROM moved
+        ON CONFLICT (booking_id) DO NOTHING
+        '''
+        pool = await self.get_pool()
+        archived = 0
+        while True:
+            status = await pool.execute(sql, to_timestamp(before), batch_size, to_timestamp(datetime.now()))
+            moved = int(status.split()[-1])
+            archived += moved
+            if moved < batch_size:
+                return archived
+
+    async def get_pending_reminders(self, now):
+        sql = '''
+        SELECT booking_id, start_at
+        FROM booking
+        WHERE NOT reminder_sent AND start_at > $1 AND amount_people IS NOT NULL
+        '''
+        return await self.fetch(sql, to_timestamp(now))
+
+    async def get_bookings_for_reminder(self, booking_ids):
+        # Every bot process schedules every pending reminder, so the rows are claimed before anything is
+        # sent: a concurrent UPDATE waits for the row lock and then skips what the other one set. The ones
+        # that could not be delivered are handed back through release_reminders
+        sql = '''
+        WITH claimed AS (
+            UPDATE booking
+            SET reminder_sent = TRUE
+            WHERE NOT reminder_sent
+            AND booking_id = ANY($1::bigint[])
+            RETURNING booking_id, chat_id, category_id, date, time
+        )
+        SELECT b.booking_id, b.chat_id, b.category_id, b.date, b.time, c.category_name, u.language
+        FROM claimed b
+        JOIN categories c ON b.category_id = c.category_id
+        LEFT JOIN users u ON b.chat_id = u.chat_id
+        '''
+        return await self.fetch(sql, list(booking_ids))
+
+    async def release_reminders(self, booking_ids):
+        sql = '''
+        UPDATE booking
+        SET reminder_sent = FALSE
+        WHERE booking_id = ANY($1::bigint[])
+        '''
+        await self.execute(sql, list(booking_ids))
+
+    async def mark_reminders_sent(self, booking_ids):
+        sql = '''
+        UPDATE booking
+        SET reminder_sent = TRUE
+        WHERE booking_id = ANY($1::bigint[])
+        '''
+        await self.execute(sql, list(booking_ids))
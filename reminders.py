@@ -0,0 +1,192 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime
+
+from cache import LRUCache
+from database import to_timestamp
+from langs import langs
+from metrics import registry
+
+REMINDER_LEAD = 24 * 60 * 60
+
+# Telegram allows about 30 messages per second overall and one per second to the same chat
+MESSAGES_PER_SECOND = 30
+CHAT_INTERVAL = 1
+MAX_CONCURRENT_SENDS = 10
+# Undelivered reminders are retried after 30 s, 1 min, 2 min, ... up to 15 min apart, about 1.5 h in all
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 15 * 60
+MAX_RETRIES = 10
+# Used for chats that never picked a language, so their reminder still goes out
+DEFAULT_LANGUAGE = 'en'
+
+
+class ReminderScheduler:
+    def __init__(self, send):
+        self.send = send
+        self.heap = []
+        self.due = {}
+        self.attempts = {}
+        self.wakeup = asyncio.Event()
+        self.forward = None
+
+    def schedule(self, booking_id, start_at, now=None):
+        # With `now`, a booking that starts within REMINDER_LEAD is left out instead of being reminded
+        # right after its confirmation; returns whether the reminder was scheduled
+        if now is not None and start_at - REMINDER_LEAD <= now:
+            return False
+        if self.forward is not None:
+            self.forward.put(('schedule', booking_id, start_at))
+            return True
+        due = start_at - REMINDER_LEAD
+        self.due[booking_id] = due
+        heapq.heappush(self.heap, (due, booking_id))
+        if self.heap[0] == (due, booking_id):
+            self.wakeup.set()
+        return True
+
+    def cancel(self, booking_id):
+        if self.forward is not None:
+            self.forward.put(('cancel', booking_id))
+            return
+        # The heap entry is left in place and skipped once it comes due
+        self.due.pop(booking_id, None)
+        self.attempts.pop(booking_id, None)
+
+    def pop_due(self, now):
+        booking_ids = []
+        while self.heap and self.heap[0][0] <= now:
+            due, booking_id = heapq.heappop(self.heap)
+            if self.due.get(booking_id) == due:
+                del self.due[booking_id]
+                booking_ids.append(booking_id)
+                registry.observe('reminder_lag_seconds', max(now - due, 0))
+        return booking_ids
+
+    def retry(self, booking_ids, undelivered, now):
+        # Bookings the sender could not deliver go back on the heap with a growing delay. Ones it did
+        # not report were delivered, already reminded or deleted, and are forgotten
+        undelivered = set(undelivered)
+        for booking_id in booking_ids:
+            attempts = self.attempts.pop(booking_id, 0) + 1
+            if booking_id not in undelivered or booking_id in self.due:
+                continue
+            if attempts > MAX_RETRIES:
+                logging.error('Giving up on the reminder for booking %s after %s attempts', booking_id, attempts)
+                registry.inc('reminders_dropped_total')
+                continue
+            self.attempts[booking_id] = attempts
+            due = now + min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+            self.due[booking_id] = due
+            heapq.heappush(self.heap, (due, booking_id))
+
+    async def listen(self, events):
+        # Applies schedule/cancel calls forwarded by other worker processes until the None the
+        # webhook server sends at shutdown, which also frees the executor thread blocked in get()
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await loop.run_in_executor(None, events.get)
+            if event is None:
+                return
+            action, *args = event
+            getattr(self, action)(*args)
+
+    async def run(self):
+        while True:
+            now = to_timestamp(datetime.now())
+            booking_ids = self.pop_due(now)
+            if booking_ids:
+                try:
+                    undelivered = await self.send(booking_ids)
+                except Exception:
+                    logging.exception('Failed to send reminders for bookings %s', booking_ids)
+                    undelivered = booking_ids
+                self.retry(booking_ids, undelivered, now)
+                continue
+
+            timeout = self.heap[0][0] - now if self.heap else None
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ReminderSender:
+    def __init__(self, bot, db,
+                 rate=MESSAGES_PER_SECOND,
+                 chat_interval=CHAT_INTERVAL,
+                 concurrency=MAX_CONCURRENT_SENDS):
+        self.bot = bot
+        self.db = db
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.last_sent = LRUCache(maxsize=10000, ttl=chat_interval)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def __call__(self, booking_ids):
+        # Returns the ids that were due a reminder but could not be delivered
+        bookings = await self.db.get_bookings_for_reminder(booking_ids)
+        by_chat = {}
+        for booking in bookings:
+            by_chat.setdefault(booking[1], []).append(booking)
+
+        results = await asyncio.gather(*(self.send_digest(chat_id, chat_bookings)
+                                         for chat_id, chat_bookings in by_chat.items()))
+        delivered = [booking_id for booking_ids in results for booking_id in booking_ids]
+        if delivered:
+            await self.db.mark_reminders_sent(delivered)
+        delivered = set(delivered)
+        undelivered = [booking[0] for booking in bookings if booking[0] not in delivered]
+        if undelivered:
+            await self.db.release_reminders(undelivered)
+        return undelivered
+
+    async def send_digest(self, chat_id, bookings):
+        async with self.semaphore:
+            await self.wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, format_reminder(bookings))
+            except Exception:
+                logging.exception('Failed to send reminder to chat %s', chat_id)
+                return []
+            self.last_sent.set(chat_id, time.monotonic())
+        return [booking[0] for booking in bookings]
+
+    async def wait_for_chat(self, chat_id):
+        last_sent = self.last_sent.get(chat_id)
+        if last_sent is not None:
+            delay = last_sent + self.chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+
+def format_reminder(bookings):
+    texts = langs.get(bookings[0][6]) or langs[DEFAULT_LANGUAGE]
+    lines = [f"{booking[5]} - {booking[3]} {booking[4]}" for booking in bookings]
+    if len(lines) == 1:
+        return f"{texts['reminder']}: {lines[0]}"
+    return f"{texts['reminder']}:\n" + '\n'.join(lines)
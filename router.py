@@ -0,0 +1,43 @@
+import re
+
+SEPARATORS = re.compile('[_:]')
+
+
+class CallbackRouter:
+    def __init__(self):
+        self.routes = {}
+
+    def register(self, prefix, handler):
+        node = self.routes
+        for token in SEPARATORS.split(prefix):
+            node = node.setdefault(token, {})
+        node[None] = handler
+
+    def callback(self, *prefixes):
+        def decorator(handler):
+            for prefix in prefixes:
+                self.register(prefix, handler)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        # Walks the registered prefixes token by token and picks the longest one that matches exactly
+        tokens = SEPARATORS.split(data)
+        node = self.routes
+        handler = None
+        depth = 0
+        for index, token in enumerate(tokens):
+            node = node.get(token)
+            if node is None:
+                break
+            if None in node:
+                handler = node[None]
+                depth = index + 1
+        return handler, tokens[depth:]
+
+    async def dispatch(self, call):
+        # The tokens after the prefix are the handler's arguments, so callback_data is parsed only here
+        handler, args = self.resolve(call.data)
+        if handler is None:
+            return await call.answer()
+        return await handler(call, *args)
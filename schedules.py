@@ -0,0 +1,77 @@
+import calendar
+
+DEFAULT_CAPACITY = 5
+DEFAULT_OPENS_AT = '09:00'
+DEFAULT_CLOSES_AT = '21:00'
+DEFAULT_SLOT_MINUTES = 60
+
+
+def to_minutes(time):
+    hours, minutes = time.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def generate_time_slots(opens_at=DEFAULT_OPENS_AT, closes_at=DEFAULT_CLOSES_AT, slot_minutes=DEFAULT_SLOT_MINUTES):
+    # The last slot starts at closing time, the way the calendar has always offered it
+    return tuple(f'{minute // 60:02d}:{minute % 60:02d}'
+                 for minute in range(to_minutes(opens_at), to_minutes(closes_at) + 1, slot_minutes))
+
+
+class Schedule:
+    def __init__(self, capacity, slots):
+        self.capacity = capacity
+        self.slots = slots
+        self.slot_set = frozenset(slots)
+
+    def is_open(self, time):
+        return time in self.slot_set
+
+
+CLOSED = Schedule(0, ())
+
+
+class Schedules:
+    # Capacity and time slots of every category, compiled once from the categories and
+    # schedule_overrides rows. Lookups are plain dict hits; a change builds a new Schedules
+    # instead of mutating this one, so readers on other threads always see a consistent copy
+    def __init__(self, categories=(), overrides=()):
+        self.default = Schedule(DEFAULT_CAPACITY, generate_time_slots())
+        settings = {}
+        self.categories = {}
+        for category_id, capacity, opens_at, closes_at, slot_minutes in categories:
+            settings[category_id] = (capacity, opens_at, closes_at, slot_minutes)
+            self.categories[category_id] = Schedule(capacity, generate_time_slots(opens_at, closes_at, slot_minutes))
+
+        # Overrides replace single days; columns left NULL fall back to the category's own settings
+        self.overrides = {}
+        for category_id, date, closed, *override in overrides:
+            if closed:
+                self.overrides[(category_id, str(date))] = CLOSED
+                continue
+            base = settings.get(category_id, (DEFAULT_CAPACITY, DEFAULT_OPENS_AT, DEFAULT_CLOSES_AT,
+                                              DEFAULT_SLOT_MINUTES))
+            capacity, opens_at, closes_at, slot_minutes = (value if value is not None else default
+                                                           for value, default in zip(override, base))
+            self.overrides[(category_id, str(date))] = Schedule(
+                capacity, generate_time_slots(opens_at, closes_at, slot_minutes))
+
+    def get(self, category_id, date):
+        schedule = self.overrides.get((category_id, str(date)))
+        if schedule is None:
+            schedule = self.categories.get(category_id, self.default)
+        return schedule
+
+    def remaining_capacity(self, category_id, year, month, rows):
+        # rows are (date, time, confirmed bookings); returns how many bookings every day of the
+        # month can still take across its time slots
+        booked = {}
+        for date, time, count in rows:
+            schedule = self.get(category_id, date)
+            if schedule.is_open(time):
+                booked[date] = booked.get(date, 0) + min(count, schedule.capacity)
+        remaining = {}
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            date = f'{year:04d}-{month:02d}-{day:02d}'
+            schedule = self.get(category_id, date)
+            remaining[day] = schedule.capacity * len(schedule.slots) - booked.get(date, 0)
+        return remaining
@@ -0,0 +1,79 @@
+from typing import Protocol
+
+import config
+
+
+class Storage(Protocol):
+    # What the handlers, keyboards and reminders need from a backend. categories_version changes
+    # whenever the category list may have changed, so cached menus can be keyed on it
+    categories_version: int
+
+    async def migrate(self): ...
+
+    async def close(self): ...
+
+    async def flush_writes(self): ...
+
+    async def flush_periodically(self, interval): ...
+
+    async def get_user_by_chat_id(self, chat_id): ...
+
+    async def first_register_user(self, chat_id, full_name): ...
+
+    async def update_user_to_finish_register(self, chat_id, phone): ...
+
+    async def set_user_language(self, chat_id, lang): ...
+
+    async def get_user_language(self, chat_id): ...
+
+    async def get_all_categories(self): ...
+
+    async def set_category_schedule(self, category_id, capacity, opens_at, closes_at, slot_minutes): ...
+
+    async def set_schedule_override(self, category_id, date, closed=False, capacity=None, opens_at=None,
+                                    closes_at=None, slot_minutes=None): ...
+
+    async def delete_schedule_override(self, category_id, date): ...
+
+    async def reserve(self, chat_id, category_id, date, time, amount_people): ...
+
+    async def get_available_times(self, date, category_id): ...
+
+    async def check_availability(self, category_id, date, time): ...
+
+    async def get_month_availability(self, category_id, year, month): ...
+
+    async def get_upcoming_bookings(self, chat_id, now, limit, after=None, before=None): ...
+
+    async def get_booking_by_id(self, booking_id): ...
+
+    async def delete_booking(self, booking_id): ...
+
+    async def archive_bookings(self, before): ...
+
+    async def get_pending_reminders(self, now): ...
+
+    # A backend shared by several bot processes claims the rows it returns here, so only one process
+    # sends each reminder; release_reminders gives back the ones that could not be delivered
+    async def get_bookings_for_reminder(self, booking_ids): ...
+
+    async def release_reminders(self, booking_ids): ...
+
+    async def mark_reminders_sent(self, booking_ids): ...
+
+
+def create_storage(backend=config.STORAGE) -> Storage:
+    # Backends are imported lazily so only the selected one's driver has to be installed
+    if backend == 'sqlite':
+        from database import AsyncDatabase
+        return AsyncDatabase()
+    if backend == 'memory':
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    if backend == 'postgres':
+        from postgres_storage import PostgresStorage
+        return PostgresStorage(config.POSTGRES_DSN)
+    raise ValueError(f'Unknown storage backend: {backend!r}')
+
+
+db = create_storage()
@@ -0,0 +1,39 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'reserve.db'))
+    database.migrate()
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def postgres_dsn():
+    # A DSN for an empty schema on the server in POSTGRES_DSN; skips when there is none
+    asyncpg = pytest.importorskip('asyncpg')
+    dsn = os.environ.get('POSTGRES_DSN')
+    if not dsn:
+        pytest.skip('POSTGRES_DSN is not set')
+
+    async def reset_schema():
+        connection = await asyncpg.connect(dsn)
+        try:
+            await connection.execute('DROP SCHEMA IF EXISTS reserve_test CASCADE')
+            await connection.execute('CREATE SCHEMA reserve_test')
+        finally:
+            await connection.close()
+
+    asyncio.run(reset_schema())
+    # asyncpg passes unknown DSN parameters on as server settings
+    separator = '&' if '?' in dsn else '?'
+    return f'{dsn}{separator}search_path=reserve_test'
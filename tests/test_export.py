@@ -0,0 +1,45 @@
+import asyncio
+import io
+
+import pytest
+
+from export import export_postgres, row_writer
+
+asyncpg = pytest.importorskip('asyncpg')
+from postgres_storage import PostgresStorage  # noqa: E402
+
+INSERT_BOOKING = '''
+INSERT INTO booking(category_id, date, time, amount_people, chat_id, start_at)
+VALUES (3, '2030-01-01', '10:00', 2, 1, 1893492000)
+RETURNING booking_id
+'''
+
+
+def exported_ids(output):
+    return [int(line.split(',')[0]) for line in output.getvalue().splitlines()[1:]]
+
+
+def test_incremental_postgres_export_waits_for_ids_still_being_inserted(postgres_dsn):
+    async def scenario():
+        storage = PostgresStorage(postgres_dsn)
+        await storage.migrate()
+        await storage.close()
+        slow, fast, late = [await asyncpg.connect(postgres_dsn) for _ in range(3)]
+        transaction = slow.transaction()
+        await transaction.start()
+        slow_id = await slow.fetchval(INSERT_BOOKING)
+        fast_id = await fast.fetchval(INSERT_BOOKING)
+
+        output = io.StringIO()
+        export = asyncio.create_task(export_postgres(postgres_dsn, 'booking', row_writer(output, 'csv'), 0, True))
+        await asyncio.sleep(0.3)
+        assert not export.done()
+        # The bot's writes go on while the export waits
+        late_id = await asyncio.wait_for(late.fetchval(INSERT_BOOKING), 1)
+        await transaction.commit()
+        assert await export == (2, fast_id)
+        assert exported_ids(output) == [slow_id, fast_id] and late_id > fast_id
+        for connection in (slow, fast, late):
+            await connection.close()
+
+    asyncio.run(scenario())
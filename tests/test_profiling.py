@@ -0,0 +1,36 @@
+from datetime import datetime
+
+import pytest
+
+from database import Database
+
+
+@pytest.fixture
+def profiled(tmp_path):
+    # Every statement counts as slow, so each one is recorded and explained
+    database = Database(str(tmp_path / 'reserve.db'), slow_query_ms=1e-6)
+    database.migrate()
+    yield database
+    database.close()
+
+
+def test_transaction_statements_reach_the_query_report(profiled):
+    profiled.set_user_language(1, 'en')
+    profiled.reserve(1, 3, '2020-01-01', '10:00', 2)
+    profiled.flush_writes()
+    profiled.archive_batch(datetime(2025, 1, 1))
+    statements = ' | '.join(profiled.query_stats)
+    for statement in ('SELECT COUNT(*) FROM booking', 'INSERT INTO booking(', 'INSERT INTO users (chat_id, language)',
+                      'WHERE start_at < ? LIMIT ?', 'INSERT OR REPLACE INTO booking_archive', 'DELETE FROM booking'):
+        assert statement in statements
+
+
+def test_id_lists_of_any_length_share_one_label(profiled, caplog):
+    booking_ids = [profiled.reserve(1, 3, '2030-01-01', '10:00', 2)[0] for _ in range(3)]
+    profiled.get_bookings_for_reminder(booking_ids[:1])
+    profiled.get_bookings_for_reminder(booking_ids)
+    labels = [label for label in profiled.query_stats if 'b.booking_id IN' in label]
+    assert len(labels) == 1 and labels[0].endswith('AND b.booking_id IN (…)')
+    assert profiled.query_stats[labels[0]][0] == 2
+    # The slow-query log still explains the statement that actually ran
+    assert 'USING INTEGER PRIMARY KEY' in caplog.text
@@ -0,0 +1,55 @@
+import re
+from datetime import datetime
+
+BOOKING_ALIAS = re.compile(r'\bbooking\s+(?:AS\s+)?(?!WHERE|SET|ORDER|GROUP|LIMIT|JOIN|LEFT|VALUES)(\w+)', re.I)
+SKIPPED = ('BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA', 'EXPLAIN')
+
+
+def run_every_query(database):
+    # Goes through every Database method that reaches the booking table at least once
+    now = datetime(2029, 12, 1)
+    database.first_register_user(1, 'User')
+    database.set_user_language(1, 'en')
+    database.update_user_to_finish_register(1, '+1')
+    database.flush_writes()
+    database.users.clear()
+    database.get_user_language(1)
+    database.get_all_categories()
+    booking_ids = [database.reserve(1, 1, '2030-01-01', time, 2)[0] for time in ('09:00', '10:00', '11:00')]
+    database.occupancy.clear()
+    database.get_available_times('2030-01-01', 1)
+    database.occupancy.clear()
+    database.check_availability(1, '2030-01-01', '10:00')
+    database.get_month_availability(1, 2030, 1)
+    page = database.get_upcoming_bookings(1, now, 2)
+    database.get_upcoming_bookings(1, now, 2, after=(page[-1][3], page[-1][0]))
+    database.get_upcoming_bookings(1, now, 2, before=(page[-1][3], page[-1][0]))
+    database.get_booking_by_id(booking_ids[0])
+    database.get_pending_reminders(now)
+    database.get_bookings_for_reminder(booking_ids)
+    database.mark_reminders_sent(booking_ids[:2])
+    database.flush_writes()
+    database.delete_booking(booking_ids[2])
+    database.archive_batch(datetime(2031, 1, 1))
+
+
+def full_scans(database, statement):
+    aliases = {'booking'} | {alias.lower() for alias in BOOKING_ALIAS.findall(statement)}
+    plan = database.database.execute(f'EXPLAIN QUERY PLAN {statement}').fetchall()
+    return [row[3] for row in plan
+            if row[3].startswith('SCAN ') and row[3].split()[1].lower() in aliases]
+
+
+def test_no_query_scans_the_booking_table(database):
+    statements = []
+    for connection in database.connections():
+        connection.set_trace_callback(statements.append)
+    run_every_query(database)
+    for connection in database.connections():
+        connection.set_trace_callback(None)
+
+    booking_statements = {statement for statement in statements
+                          if 'booking' in statement.lower() and not statement.lstrip().upper().startswith(SKIPPED)}
+    assert len(booking_statements) >= 15
+    scans = {statement: full_scans(database, statement) for statement in booking_statements}
+    assert {statement: plan for statement, plan in scans.items() if plan} == {}
@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime
+
+from langs import langs
+from memory_storage import MemoryStorage
+from reminders import REMINDER_LEAD, RETRY_DELAY, ReminderScheduler, ReminderSender, format_reminder
+
+
+class FlakyBot:
+    def __init__(self, failures):
+        self.failures = failures
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('Telegram is unreachable')
+        self.sent.append(chat_id)
+
+
+def test_reminder_sees_a_language_still_waiting_to_be_written(database):
+    booking_id, _ = database.reserve(1, 3, '2030-01-01', '10:00', 2)
+    database.set_user_language(1, 'ru')
+    bookings = database.get_bookings_for_reminder([booking_id])
+    assert bookings[0][6] == 'ru'
+    assert format_reminder(bookings).startswith(langs['ru']['reminder'])
+
+
+def test_reminder_without_a_language_falls_back_to_the_default():
+    bookings = [(1, 1, 3, '2030-01-01', '10:00', 'Restaurants', None)]
+    assert format_reminder(bookings) == f"{langs['en']['reminder']}: Restaurants - 2030-01-01 10:00"
+
+
+def test_undelivered_reminder_is_retried_with_a_backoff():
+    async def scenario():
+        storage = MemoryStorage()
+        await storage.migrate()
+        booking_id, _ = await storage.reserve(1, 3, '2030-01-01', '10:00', 2)
+        bot = FlakyBot(failures=1)
+        scheduler = ReminderScheduler(ReminderSender(bot, storage))
+        scheduler.schedule(booking_id, 1000 + REMINDER_LEAD)
+
+        booking_ids = scheduler.pop_due(1000)
+        scheduler.retry(booking_ids, await scheduler.send(booking_ids), 1000)
+        assert scheduler.pop_due(1000 + RETRY_DELAY - 1) == []
+
+        booking_ids = scheduler.pop_due(1000 + RETRY_DELAY)
+        assert booking_ids == [booking_id]
+        scheduler.retry(booking_ids, await scheduler.send(booking_ids), 1000 + RETRY_DELAY)
+        assert bot.sent == [1]
+        assert scheduler.due == {} and scheduler.attempts == {}
+        assert await storage.get_pending_reminders(datetime(2029, 1, 1)) == []
+
+    asyncio.run(scenario())
+
+
+def test_booking_within_the_reminder_lead_is_not_scheduled():
+    async def scenario():
+        scheduler = ReminderScheduler(None)
+        assert not scheduler.schedule(1, 1000 + REMINDER_LEAD, now=1000)
+        assert scheduler.schedule(2, 1001 + REMINDER_LEAD, now=1000)
+        # Reminders loaded at startup are still sent late rather than never
+        assert scheduler.schedule(3, 500 + REMINDER_LEAD)
+        assert scheduler.pop_due(1000) == [3]
+        assert scheduler.pop_due(1001) == [2]
+
+    asyncio.run(scenario())
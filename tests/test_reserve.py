@@ -0,0 +1,34 @@
+import threading
+
+from database import Database
+
+THREADS = 20
+ATTEMPTS = 10
+
+
+def test_concurrent_reservations_never_exceed_capacity(database, tmp_path):
+    capacity = database.get_schedule(3, '2030-01-01').capacity
+    # Every thread has its own Database, so the reservations compete as separate processes would
+    databases = [Database(str(tmp_path / 'reserve.db'), read_pool_size=1) for _ in range(THREADS)]
+    barrier = threading.Barrier(THREADS)
+    results = []
+
+    def book(db, chat_id):
+        barrier.wait()
+        for _ in range(ATTEMPTS):
+            results.append(db.reserve(chat_id, 3, '2030-01-01', '10:00', 2)[0])
+
+    threads = [threading.Thread(target=book, args=(db, index)) for index, db in enumerate(databases)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for db in databases:
+        db.close()
+
+    confirmed = database.manager('''
+    SELECT COUNT(*) FROM booking WHERE category_id = 3 AND date = '2030-01-01' AND time = '10:00'
+    ''', fetchone=True)[0]
+    assert len(results) == THREADS * ATTEMPTS
+    assert len([booking_id for booking_id in results if booking_id]) == capacity
+    assert confirmed == capacity
@@ -0,0 +1,39 @@
+import asyncio
+
+from router import CallbackRouter
+
+
+class Call:
+    def __init__(self, data):
+        self.data = data
+        self.answered = False
+
+    async def answer(self):
+        self.answered = True
+
+
+def dispatch(router, data):
+    call = Call(data)
+    return asyncio.run(router.dispatch(call)), call
+
+
+def test_handlers_get_the_tokens_after_their_prefix():
+    router = CallbackRouter()
+
+    @router.callback('calendar:day')
+    async def select_date(call, year, month, day, category_id):
+        return 'day', year, month, day, category_id
+
+    @router.callback('calendar:prev_month', 'calendar:next_month')
+    async def change_month(call, year, month, day, category):
+        return 'month', year, month, category
+
+    @router.callback('alternative')
+    async def select_alternative_time(call, hours, minutes):
+        return f'{hours}:{minutes}'
+
+    assert dispatch(router, 'calendar:day:2030:1:5:3')[0] == ('day', '2030', '1', '5', '3')
+    assert dispatch(router, 'calendar:next_month:2030:2:0:3')[0] == ('month', '2030', '2', '3')
+    assert dispatch(router, 'alternative_10:00')[0] == '10:00'
+    result, call = dispatch(router, 'ignore')
+    assert result is None and call.answered
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from database import AsyncDatabase, Database
+from memory_storage import MemoryStorage
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def storage(request, tmp_path):
+    if request.param == 'sqlite':
+        return AsyncDatabase(Database(str(tmp_path / 'reserve.db')))
+    return MemoryStorage()
+
+
+def run(storage, scenario):
+    async def wrapped():
+        await storage.migrate()
+        try:
+            return await scenario(storage)
+        finally:
+            await storage.close()
+    return asyncio.run(wrapped())
+
+
+def test_closed_day_override(storage):
+    async def scenario(storage):
+        await storage.set_schedule_override(3, '2030-01-01', closed=True)
+        assert await storage.get_available_times('2030-01-01', 3) == []
+        assert not await storage.check_availability(3, '2030-01-01', '10:00')
+        assert await storage.reserve(1, 3, '2030-01-01', '10:00', 2) == (None, 0)
+        assert (await storage.get_month_availability(3, 2030, 1))[1] == 0
+        await storage.delete_schedule_override(3, '2030-01-01')
+        assert (await storage.reserve(1, 3, '2030-01-01', '10:00', 2))[0]
+
+    run(storage, scenario)
+
+
+def test_capacity_override(storage):
+    async def scenario(storage):
+        await storage.set_schedule_override(3, '2030-01-01', capacity=1, opens_at='10:00', closes_at='12:00')
+        assert await storage.get_available_times('2030-01-01', 3) == ['10:00', '11:00', '12:00']
+        assert await storage.reserve(1, 3, '2030-01-01', '10:00', 2) == (1, 0)
+        assert await storage.reserve(2, 3, '2030-01-01', '10:00', 2) == (None, 0)
+        assert (await storage.get_month_availability(3, 2030, 1))[1] == 2
+        # The next day keeps the category's own capacity of 20
+        assert (await storage.reserve(2, 3, '2030-01-02', '10:00', 2))[1] == 19
+
+    run(storage, scenario)
+
+
+def test_schedule_edited_by_another_process_shows_up(tmp_path):
+    path = str(tmp_path / 'reserve.db')
+    worker, other = Database(path, shared=True), Database(path, shared=True)
+    worker.migrate()
+    assert worker.check_availability(3, '2030-01-01', '10:00')
+    assert worker.get_month_availability(3, 2030, 1)[1] == 13 * 20
+    other.set_schedule_override(3, '2030-01-01', closed=True)
+    assert worker.check_availability(3, '2030-01-01', '10:00')
+    worker.schedules_loaded -= worker.schedules_ttl + 1
+    assert not worker.check_availability(3, '2030-01-01', '10:00')
+    assert worker.get_month_availability(3, 2030, 1)[1] == 0
+    worker.close()
+    other.close()
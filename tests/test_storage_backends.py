@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from database import AsyncDatabase, Database
+from memory_storage import MemoryStorage
+from reminders import ReminderSender
+
+
+async def call_sequence(storage):
+    await storage.migrate()
+    results = []
+    await storage.first_register_user(1, 'Alice')
+    await storage.set_user_language(1, 'en')
+    await storage.update_user_to_finish_register(1, '+998901234567')
+    await storage.set_user_language(2, 'ru')
+    results.append(await storage.get_user_by_chat_id(1))
+    results.append(await storage.get_user_language(2))
+    results.append(await storage.get_all_categories())
+    for _ in range(7):
+        results.append(await storage.reserve(1, 1, '2030-01-01', '10:00', 2))
+    results.append(await storage.reserve(2, 1, '2030-01-01', '11:00', 2))
+    # Chat 3 never registered; every backend takes the booking anyway
+    results.append(await storage.reserve(3, 2, '2030-01-02', '12:00', 1))
+    results.append(await storage.get_available_times('2030-01-01', 1))
+    results.append(await storage.check_availability(1, '2030-01-01', '10:00'))
+    results.append(await storage.get_month_availability(1, 2030, 1))
+    page = await storage.get_upcoming_bookings(1, datetime(2029, 1, 1), 3)
+    results.append(page)
+    results.append(await storage.get_upcoming_bookings(1, datetime(2029, 1, 1), 3, after=(page[-1][3], page[-1][0])))
+    results.append(await storage.get_upcoming_bookings(1, datetime(2029, 1, 1), 3, before=(page[-1][3], page[-1][0])))
+    results.append(await storage.get_booking_by_id(2))
+    await storage.delete_booking(2)
+    results.append(await storage.get_booking_by_id(2))
+    results.append(sorted(await storage.get_pending_reminders(datetime(2029, 1, 1))))
+    results.append(sorted(await storage.get_bookings_for_reminder([1, 3, 6, 7])))
+    # What ReminderSender does when only the reminders for 1 and 6 get through
+    await storage.mark_reminders_sent([1, 6])
+    await storage.release_reminders([3, 7])
+    await storage.flush_writes()
+    results.append(sorted(await storage.get_bookings_for_reminder([1, 3, 6, 7])))
+    await storage.close()
+    return normalize(results)
+
+
+def normalize(value):
+    # asyncpg hands back Record objects and sqlite3 tuples; compare them all as plain tuples
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    if isinstance(value, tuple) or type(value).__name__ == 'Record':
+        return tuple(normalize(item) for item in value)
+    return value
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'postgres'])
+def test_backends_match_memory_storage(backend, request, tmp_path):
+    if backend == 'sqlite':
+        storage = AsyncDatabase(Database(str(tmp_path / 'reserve.db')))
+    else:
+        from postgres_storage import PostgresStorage
+        storage = PostgresStorage(request.getfixturevalue('postgres_dsn'))
+    assert asyncio.run(call_sequence(storage)) == asyncio.run(call_sequence(MemoryStorage()))
+
+
+class RecordingBot:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.fail:
+            raise ConnectionError('Telegram is unreachable')
+        self.sent.append(chat_id)
+
+
+def test_postgres_processes_send_each_reminder_once(postgres_dsn):
+    from postgres_storage import PostgresStorage
+
+    async def scenario():
+        first, second = PostgresStorage(postgres_dsn), PostgresStorage(postgres_dsn)
+        await first.migrate()
+        await second.migrate()
+        booking_ids = [(await first.reserve(chat_id, 3, '2030-01-01', '10:00', 2))[0] for chat_id in range(1, 21)]
+        # Both processes loaded every pending reminder at startup and both come due together
+        bots = [RecordingBot(), RecordingBot()]
+        await asyncio.gather(ReminderSender(bots[0], first)(booking_ids),
+                             ReminderSender(bots[1], second)(booking_ids))
+        assert sorted(bots[0].sent + bots[1].sent) == list(range(1, 21))
+
+        # A process that cannot deliver hands its claim back for a retry
+        booking_id, _ = await first.reserve(21, 3, '2030-01-01', '11:00', 2)
+        assert await ReminderSender(RecordingBot(fail=True), first)([booking_id]) == [booking_id]
+        assert [row[0] for row in await second.get_pending_reminders(datetime(2029, 1, 1))] == [booking_id]
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,53 @@
+import asyncio
+import queue
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import config
+from webhook import create_app
+
+SECRET = 'test-secret'
+MESSAGE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 10, 'date': 1893456000, 'text': '/start',
+        'from': {'id': 7, 'is_bot': False, 'first_name': 'Alice'},
+        'chat': {'id': 7, 'type': 'private', 'first_name': 'Alice'},
+    },
+}
+CALLBACK_QUERY = {
+    'update_id': 2,
+    'callback_query': {
+        'id': '42', 'chat_instance': '1', 'data': 'cancel_3',
+        'from': {'id': 8, 'is_bot': False, 'first_name': 'Bob'},
+        'message': {
+            'message_id': 11, 'date': 1893456000, 'text': 'Bookings',
+            'chat': {'id': 8, 'type': 'private', 'first_name': 'Bob'},
+        },
+    },
+}
+
+
+def post_updates(updates, secret=SECRET):
+    async def scenario():
+        queues = [queue.Queue(), queue.Queue()]
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        async with TestClient(TestServer(create_app(queues, SECRET))) as client:
+            statuses = [(await client.post(config.WEBHOOK_PATH, json=update, headers=headers)).status
+                        for update in updates]
+        return statuses, [list(updates.queue) for updates in queues]
+
+    return asyncio.run(scenario())
+
+
+def test_updates_go_to_the_queue_of_their_chat():
+    statuses, queued = post_updates([MESSAGE, CALLBACK_QUERY, MESSAGE])
+    assert statuses == [200, 200, 200]
+    assert queued == [[CALLBACK_QUERY], [MESSAGE, MESSAGE]]
+
+
+def test_updates_without_the_secret_token_are_rejected():
+    for secret in (None, 'guessed'):
+        statuses, queued = post_updates([MESSAGE, CALLBACK_QUERY], secret)
+        assert statuses == [403, 403]
+        assert queued == [[], []]
@@ -0,0 +1,19 @@
+import sqlite3
+
+import pytest
+
+
+def test_failed_flush_keeps_the_queued_writes(database, tmp_path):
+    database.first_register_user(1, 'Alice')
+    database.database.execute('PRAGMA busy_timeout = 0')
+    locker = sqlite3.connect(str(tmp_path / 'reserve.db'))
+    locker.execute('BEGIN IMMEDIATE')
+    database.set_user_language(1, 'ru')
+    with pytest.raises(sqlite3.OperationalError):
+        database.flush_writes()
+    assert len(database.pending_writes) == 1
+
+    locker.rollback()
+    locker.close()
+    assert database.flush_writes() == 1
+    assert database.manager('SELECT language FROM users WHERE chat_id = 1', fetchone=True)[0] == 'ru'
@@ -0,0 +1,113 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+import config
+
+
+def get_chat_id(update):
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        message = value.get('message', value)
+        if 'chat' in message:
+            return message['chat']['id']
+        if 'from' in value:
+            return value['from']['id']
+    return 0
+
+
+async def receive_update(request):
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(secret, request.app['secret']):
+        raise web.HTTPForbidden()
+    update = await request.json()
+    queues = request.app['queues']
+    queues[get_chat_id(update) % len(queues)].put(update)
+    return web.Response()
+
+
+async def set_webhook(app):
+    if config.WEBHOOK_HOST:
+        await app['bot'].set_webhook(config.WEBHOOK_HOST + config.WEBHOOK_PATH, secret_token=app['secret'])
+
+
+async def close_bot(app):
+    session = await app['bot'].get_session()
+    await session.close()
+
+
+def create_app(queues, secret=config.WEBHOOK_SECRET):
+    app = web.Application()
+    app['queues'] = queues
+    app['secret'] = secret
+    app.router.add_post(config.WEBHOOK_PATH, receive_update)
+    return app
+
+
+def start_webhook(bot, run_worker, workers=config.WEBHOOK_WORKERS):
+    # run_worker(index, updates, reminder_events) is started in every worker process.
+    # Updates of one chat always go to the same worker, so they are handled in the order they arrived
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    reminder_events = context.Queue()
+    processes = [context.Process(target=run_worker, args=(index, queue, reminder_events), daemon=True)
+                 for index, queue in enumerate(queues)]
+    for process in processes:
+        process.start()
+
+    app = create_app(queues)
+    app['bot'] = bot
+    app.on_startup.append(set_webhook)
+    app.on_cleanup.append(close_bot)
+    try:
+        web.run_app(app, host=config.WEBAPP_HOST, port=config.WEBAPP_PORT)
+    finally:
+        for queue in queues:
+            queue.put(None)
+        reminder_events.put(None)
+        for process in processes:
+            process.join()
+
+
+def run_worker(dp, updates, on_startup=None, on_shutdown=None):
+    asyncio.run(process_updates(dp, updates, on_startup, on_shutdown))
+
+
+async def process_updates(dp, updates, on_startup=None, on_shutdown=None):
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    if on_startup:
+        await on_startup(dp)
+
+    loop = asyncio.get_running_loop()
+    chats = {}
+    while True:
+        update = await loop.run_in_executor(None, updates.get)
+        if update is None:
+            break
+        chat_id = get_chat_id(update)
+        task = asyncio.create_task(process_in_order(dp, update, chats.get(chat_id)))
+        chats[chat_id] = task
+        task.add_done_callback(lambda done, chat_id=chat_id: chats.get(chat_id) is done and chats.pop(chat_id))
+
+    if chats:
+        await asyncio.wait(list(chats.values()))
+    if on_shutdown:
+        await on_shutdown(dp)
+    session = await dp.bot.get_session()
+    await session.close()
+
+
+async def process_in_order(dp, update, previous=None):
+    if previous:
+        await asyncio.wait([previous])
+    try:
+        await dp.process_update(Update(**update))
+    except Exception:
+        logging.exception('Failed to process update %s', update.get('update_id'))